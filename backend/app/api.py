@@ -1,40 +1,63 @@
 
-from fastapi import FastAPI,Header, Security, Depends, HTTPException, status
+from app.services.startup import startup_profile  # first: times the imports below
+from fastapi import FastAPI,Header, Security, Depends, HTTPException, status, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 import base64
 #from streamlit.utils import get_session_id
 from pydantic import BaseModel
 from typing import List,Optional,Literal
-import pandas as pd
 import json
 import sys
 from pathlib import Path
 import os
 import secrets
+import hashlib
+import asyncio
+import time
 #sys.path.append(str(Path(__file__).resolve().parent.parent / "mlops/src/models"))
 #sys.path.append(str(Path(__file__).resolve().parent.parent / "mlops/src/data"))
 import os
 print("Current Working Directory:", os.getcwd())  # Check where FastAPI is executing from
 #from app.services.tools.cypher import cypher_qa_tool as generate_response
 from app.services.tools.cypher_to_d3 import cypher_qa_tool as generate_response
-from app.services.tools.neo4j_to_json import to_d3_format
-from app.services.tools.expand import expand_person, expand_movie
-from app.services.graph import enhanced_graph as graph
+from app.services.tools.cypher_to_d3 import cypher_qa_stream as generate_response_stream
+from app.services.tools.cypher_guard import CypherRejected
+from app.services.tools.expand import expand_person, expand_movie, expand_batch
+from app.services.graph import async_driver, current_generation, run_query
+from app.services.cache import TTLCache
+from app.services.result_cache import result_cache, result_key
+from app.services.node_store import node_store
+from app.services.schema import schema_store
+from app.services import metrics
+from app.services.timing import stage, start_timings
+from app.services.query_log import SLOW_QUERY_MS, query_log
+from app.services.llm import llm_ready
+from app.services.tools.gazetteer import gazetteer
+from app.services.tools.name_index import name_index
+from app.services.tools.wire_format import encode, negotiate
+from app.services.tools.delta import delta, known_set
 
 
-def enrich_with_betweenness(d3_data):
+async def enrich_with_betweenness(d3_data):
     """Fetch betweennessCentrality directly from Neo4j and merge into D3 node data.
 
+    A lookup in the node store once it is warm; the query is the fallback
+    while it is still loading.
+
     Ids are split by node type so each lookup is anchored on a label. An
     untyped MATCH (n) gives the planner no label to hang an index on, so it
     scans all 25M nodes; :Person and :Movie both have an index on their id.
     """
+    if node_store.ready:
+        node_store.enrich(d3_data['nodes'], fields=("betweennessCentrality",))
+        return d3_data
     person_ids = [n['id'] for n in d3_data['nodes'] if n.get('type') == 'Person']
     movie_ids = [n['id'] for n in d3_data['nodes'] if n.get('type') == 'Movie']
     if not person_ids and not movie_ids:
         return d3_data
-    results = graph.query(
+    results = await run_query(
         "UNWIND $personIds AS pid "
         "MATCH (p:Person {personId: pid}) "
         "RETURN p.personId AS id, p.betweennessCentrality AS betweennessCentrality "
@@ -42,7 +65,8 @@ def enrich_with_betweenness(d3_data):
         "UNWIND $movieIds AS mid "
         "MATCH (m:Movie {movieId: mid}) "
         "RETURN m.movieId AS id, m.betweennessCentrality AS betweennessCentrality",
-        {"personIds": person_ids, "movieIds": movie_ids}
+        {"personIds": person_ids, "movieIds": movie_ids},
+        source="enrich_with_betweenness",
     )
     pr_map = {r['id']: r['betweennessCentrality'] for r in results if r['betweennessCentrality'] is not None}
     for node in d3_data['nodes']:
@@ -50,6 +74,7 @@ def enrich_with_betweenness(d3_data):
             node['betweennessCentrality'] = pr_map[node['id']]
     return d3_data
 
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 from typing import List, Optional
 
@@ -62,7 +87,31 @@ class Query(BaseModel):
     message: str
     history: list[ChatTurn] = []  # History is optional but expected as list of turns
 
-api = FastAPI(openapi_tags=[
+class BatchSeed(BaseModel):
+    id: str  # personId / movieId, or an exact name / title
+    limit: Optional[int] = None  # films for a person, people for a movie
+
+class ExpandBatch(BaseModel):
+    persons: list[BatchSeed] = []
+    movies: list[BatchSeed] = []
+    known: list[str] = []  # node ids the client already has; see tools/delta.py
+
+@asynccontextmanager
+async def lifespan(app):
+    # Loaded in the background: the API serves from the first second, and
+    # enrichment simply has less to go on until the store is warm.
+    warm_node_store = asyncio.create_task(node_store.keep_warm())
+    # The schema snapshot was read at import; this only follows the generation.
+    fresh_schema = asyncio.create_task(schema_store.keep_fresh())
+    yield
+    warm_node_store.cancel()
+    fresh_schema.cancel()
+    # The async driver holds a connection pool; hand it back cleanly rather than
+    # leaving sockets for the server to time out on every reload.
+    await async_driver.close()
+
+
+api = FastAPI(lifespan=lifespan, openapi_tags=[
     {
         'name': 'Hello World',
         'description': 'This is a simple hello world endpoint'
@@ -78,6 +127,16 @@ api = FastAPI(openapi_tags=[
         'description': 'Drill down into the neighbourhood of a graph node'
 
     },
+    {
+        'name': 'Health',
+        'description': 'Readiness of the process and the backends it depends on'
+
+    },
+    {
+        'name': 'Admin',
+        'description': 'Operational endpoints, behind HTTP basic auth'
+
+    },
 ])
 
 # Add CORS middleware
@@ -89,21 +148,142 @@ api.add_middleware(
     allow_headers=["*"],
 )
 
-latest_intermediate_steps = []
+# Routes whose stages are timed (see timing.py). Prefixes, so /expand/person/x
+# is "/expand/person" in the metrics, whatever x.
+TIMED_ROUTES = ("/chat", "/expand/person", "/expand/movie", "/expand/batch")
+
+
+@api.middleware("http")
+async def server_timing(request: Request, call_next):
+    route = next((r for r in TIMED_ROUTES if request.url.path.startswith(r)), None)
+    if route is None:
+        return await call_next(request)
+    started = time.perf_counter()
+    timings = start_timings(route)
+    response = await call_next(request)
+    # A streamed chat sends its headers before any stage has run. Its stages
+    # still reach the histogram; its "total" is only time to first byte, so it
+    # stays out of it.
+    streamed = response.headers.get("content-type", "").startswith(CHAT_STREAM_MEDIA_TYPES)
+    timings.add("total", time.perf_counter() - started, observe=not streamed)
+    response.headers["Server-Timing"] = timings.header()
+    # Without it a cross-origin page (the frontend) sees no Server-Timing.
+    response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+# The last graph each chat session produced, already in D3 form, for
+# GET /graph/json. It used to be one module global: concurrent users overwrote
+# each other's graph, and a second worker could never see it. Bounded on both
+# axes — a session nobody comes back to ages out after the TTL, and a burst of
+# new sessions evicts the least recently used.
+session_graphs = TTLCache(
+    maxsize=int(os.getenv("SESSION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("SESSION_TTL_SECONDS", "3600")),
+)
 
 @api.get('/', tags=['Hello World'])
 def get_index():
     return {'data': 'hello world'}
 
+
+# How long /ready waits on Neo4j before calling it unreachable.
+READY_NEO4J_TIMEOUT = float(os.getenv("READY_NEO4J_TIMEOUT", "2"))
+
+
+@api.get('/ready', tags=['Health'])
+async def get_ready(response: Response):
+    """Which backends are warm, and where start-up time went.
+
+    Ready — 200 rather than 503 — once Neo4j answers and a schema is loaded,
+    which is all a chat needs. The LLM client is created on the first chat that
+    needs it, and the in-memory stores only make things faster: those are
+    reported but not waited for.
+    """
+    try:
+        generation = await asyncio.wait_for(current_generation(), READY_NEO4J_TIMEOUT)
+        neo4j = {"ready": True, "generation": generation}
+    except Exception as e:
+        neo4j = {"ready": False, "error": repr(e)}
+    backends = {
+        "neo4j": neo4j,
+        "schema": {"ready": schema_store.ready, "generation": schema_store.generation},
+        "llm": {"ready": llm_ready()},
+        "nodeStore": {"ready": node_store.ready, "generation": node_store.generation},
+        "gazetteer": {"ready": gazetteer.gazetteer is not None},
+        "nameIndex": {"ready": name_index.indexes is not None},
+    }
+    ready = neo4j["ready"] and schema_store.ready
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": ready, "backends": backends, "startup": startup_profile.report()}
+
+@api.get('/metrics', tags=['Health'], response_class=PlainTextResponse)
+def get_metrics():
+    """This worker's counters, in the Prometheus text format."""
+    return metrics.render()
+
+# Media types /chat streams in when the client's Accept names one, and the
+# framing each gets. NDJSON is one JSON event per line; SSE wraps the same
+# event in `event:`/`data:` fields for an EventSource.
+CHAT_STREAM_MEDIA_TYPES = ("application/x-ndjson", "text/event-stream")
+
+
+def _frame(event, media_type):
+    data = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+    if media_type == "text/event-stream":
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+async def _chat_events(messages, session_id, media_type):
+    """Frame `generate_response_stream`'s events for the wire.
+
+    The summary is where the complete graph lands, so that is where it is
+    stored for the session; on the wire it shrinks to counts plus what the
+    buffered response carries besides the graph. Once streaming has begun the
+    status line is gone, so a failure arrives as a final `error` event.
+    """
+    entities = {"persons": [], "movies": []}
+    try:
+        async for event in generate_response_stream(messages):
+            if event["event"] == "entities":
+                entities = event["entities"]
+            elif event["event"] == "summary":
+                d3_data = {**event["d3"], "entities": entities}
+                session_graphs.set(session_id, d3_data)
+                event = {
+                    "event": "summary",
+                    "nodes": len(d3_data["nodes"]),
+                    "links": len(d3_data["links"]),
+                    "records": event["records"],
+                    "session": session_id,
+                    "meta": {"cypherCache": event["cache"]["cypher"],
+                             "resultCache": event["cache"]["result"]},
+                }
+            yield _frame(event, media_type)
+    except Exception as e:
+        print(f"Streaming chat failed: {e!r}")
+        yield _frame({"event": "error", "detail": str(e)}, media_type)
+
+
 @api.post('/chat', tags=['Chat Query'])
 async def chat(
+    request: Request,
     payload: Query,
-    #session_id: Optional[str] = Header(None)
+    session_id: Optional[str] = Header(None)
 ):
     """
     Chat with the agent using a message and an optional session ID.
+
+    The `Session-Id` header names the session the resulting graph is stored
+    under; without one a fresh id is minted. Either way it comes back as
+    `session` in the payload, for GET /graph/json?session=.
+
+    Send `Accept: application/x-ndjson` (or `text/event-stream`) to get the
+    answer as it is built instead of all at once: `entities`, `cypher`, then
+    `nodes`/`links` batches straight off the Neo4j cursor, then `summary`.
     """
-    global latest_intermediate_steps
+    session_id = session_id or secrets.token_urlsafe(16)
 
     # Build messages history for ChatGPT
     messages = []
@@ -116,49 +296,238 @@ async def chat(
     # Add current message
     messages.append({"role": "user", "content": payload.message})
 
+    accept = request.headers.get("accept", "")
+    for media_type in CHAT_STREAM_MEDIA_TYPES:
+        if media_type in accept:
+            return StreamingResponse(
+                _chat_events(messages, session_id, media_type),
+                media_type=media_type,
+            )
+
     # Generate response using the cypher_qa_tool
-    result = generate_response(messages)
-    latest_intermediate_steps = result['intermediate_steps'][1]['context']
-    d3_data = to_d3_format(latest_intermediate_steps)
-    d3_data["entities"] = result.get("entities", {"persons": [], "movies": []})
-    return d3_data
-    
+    try:
+        result = await generate_response(messages)
+    except CypherRejected as e:
+        raise HTTPException(status_code=422,
+                            detail=f"No safe query for this question: {e.reason}")
+    # Built off the cursor, and shared with the result cache: copied, not
+    # written to.
+    d3_data = {**result["d3"],
+               "entities": result.get("entities", {"persons": [], "movies": []})}
+    session_graphs.set(session_id, d3_data)
+    return _render(request, {**d3_data, "session": session_id,
+                             "meta": {"cypherCache": result["cache"]["cypher"],
+                                      "resultCache": result["cache"]["result"]}})
+
 
 @api.get("/graph/json")
-def get_graph_json():
-    return to_d3_format(latest_intermediate_steps)
+def get_graph_json(request: Request, session: str):
+    """The last graph `session` produced, served as built — no reconversion."""
+    d3_data = session_graphs.get(session)
+    if d3_data is None:
+        raise HTTPException(status_code=404,
+                            detail=f"No graph for session '{session}' (unknown or expired)")
+    return _render(request, d3_data)
+
+
+# Drill-down responses are deterministic for a given (entity, limit) and data
+# generation, so they are cached server-side as the encoded body plus its ETag,
+# and the browser and any proxy in front may reuse them. max-age is what lets
+# Back/Forward skip the request entirely; past it, If-None-Match turns the
+# revalidation into a 304 that never reaches Neo4j while the cache is warm.
+# A generation bump changes the body, hence the ETag, so a stale copy lives at
+# most max-age.
+EXPAND_CACHE_CONTROL = os.getenv("EXPAND_CACHE_CONTROL", "public, max-age=300")
+
+
+def _encode(d3_data, media_type):
+    """Serialize for `media_type` and derive a strong ETag from the bytes."""
+    with stage("serialize"):
+        body = encode(d3_data, media_type)
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _etag_matches(if_none_match, etag):
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag
+               for tag in if_none_match.split(","))
+
+
+def _conditional_response(request, media_type, body, etag):
+    # Vary, because the same URL answers in several formats; a shared cache
+    # must not hand MessagePack to a client that asked for JSON.
+    headers = {"ETag": etag, "Cache-Control": EXPAND_CACHE_CONTROL, "Vary": "Accept"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def _render(request, payload):
+    """A D3 payload in whichever wire format the client's Accept asks for."""
+    media_type = negotiate(request.headers.get("accept"))
+    with stage("serialize"):
+        body = encode(payload, media_type)
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def _known(known, known_bloom, bloom_k):
+    try:
+        return known_set(known, known_bloom, bloom_k)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+async def _cached_expand(request, kind, entity, params, expand, known=None):
+    """Serve a drill-down from the result cache, computing it on a miss.
+
+    Cached twice over: the payload itself, and its encoding per wire format,
+    so a format nobody asked for yet costs a serialisation but no query.
+    `expand` is the coroutine function that builds the payload.
+
+    With `known`, the nodes the client already holds come back as references
+    (tools/delta.py). The payload still comes from the cache; the delta is cut
+    from it and encoded per request, since no two clients hold the same graph.
+    """
+    media_type = negotiate(request.headers.get("accept"))
+    key = await result_key(kind, entity, {**params, "format": media_type})
+    cached = None if known is not None else result_cache.get(key)
+    if cached is None:
+        payload_key = await result_key(kind, entity, params)
+        d3_data = result_cache.get(payload_key)
+        if d3_data is None:
+            d3_data = await expand()
+            result_cache.set(payload_key, d3_data)
+        if known is not None:
+            return _conditional_response(request, media_type,
+                                         *_encode(delta(d3_data, known), media_type))
+        cached = _encode(d3_data, media_type)
+        result_cache.set(key, cached)
+    return _conditional_response(request, media_type, *cached)
 
 
 @api.get("/expand/person/{person}", tags=['Explore'])
-def expand_person_endpoint(
+async def expand_person_endpoint(
+    request: Request,
     person: str,
     node_limit: int = 200,
+    known: Optional[str] = None,
+    known_bloom: Optional[str] = None,
+    bloom_k: Optional[int] = None,
 ):
     """Drill down on a Person: their full filmography first, then as many of
     those movies' directors and actors as `node_limit` still allows.
     `person` is a personId (e.g. nm0000033) or an exact name.
+
+    `known` (comma-separated ids) or `known_bloom` + `bloom_k` (a Bloom filter
+    of them) name the nodes the client has: those come back as references.
     """
     node_limit = max(10, min(node_limit, 500))
-    d3_data = expand_person(person, node_limit=node_limit)
-    if not d3_data["nodes"]:
-        # The subject is no longer a node, so an empty graph is ambiguous:
-        # `center` tells the two cases apart.
-        detail = (f"No person found for '{person}'" if d3_data["center"] is None
-                  else f"'{person}' has no films in the graph")
-        raise HTTPException(status_code=404, detail=detail)
-    return d3_data
+    held = _known(known, known_bloom, bloom_k)
+
+    async def expand():
+        d3_data = await expand_person(person, node_limit=node_limit)
+        if not d3_data["nodes"]:
+            # The subject is no longer a node, so an empty graph is ambiguous:
+            # `center` tells the two cases apart.
+            detail = (f"No person found for '{person}'" if d3_data["center"] is None
+                      else f"'{person}' has no films in the graph")
+            raise HTTPException(status_code=404, detail=detail)
+        return d3_data
+
+    return await _cached_expand(request, "expand/person", person,
+                                {"node_limit": node_limit}, expand, held)
 
 
 @api.get("/expand/movie/{movie}", tags=['Explore'])
-def expand_movie_endpoint(
+async def expand_movie_endpoint(
+    request: Request,
     movie: str,
     person_limit: int = 200,
+    known: Optional[str] = None,
+    known_bloom: Optional[str] = None,
+    bloom_k: Optional[int] = None,
 ):
     """Drill down on a Movie: every person involved in it (actors, directors,
     ...). `movie` is a movieId (e.g. tt0075148) or an exact title.
+    `known` / `known_bloom` as for /expand/person.
     """
     person_limit = max(1, min(person_limit, 200))
-    d3_data = expand_movie(movie, person_limit=person_limit)
-    if not d3_data["nodes"]:
-        raise HTTPException(status_code=404, detail=f"No movie found for '{movie}'")
-    return d3_data
\ No newline at end of file
+    held = _known(known, known_bloom, bloom_k)
+
+    async def expand():
+        d3_data = await expand_movie(movie, person_limit=person_limit)
+        if not d3_data["nodes"]:
+            raise HTTPException(status_code=404, detail=f"No movie found for '{movie}'")
+        return d3_data
+
+    return await _cached_expand(request, "expand/movie", movie,
+                                {"person_limit": person_limit}, expand, held)
+
+
+# Per-type seed cap for /expand/batch: a whole filmography is a few hundred at
+# the very most, and the merged payload grows with every seed.
+EXPAND_BATCH_MAX_SEEDS = 500
+
+
+@api.post("/expand/batch", tags=['Explore'])
+async def expand_batch_endpoint(request: Request, payload: ExpandBatch):
+    """Drill down on many nodes at once: one query per node type, merged.
+
+    Each seed carries its own `limit` — films for a person (default 200, max
+    500), people for a movie (default 200, max 200). The response is one
+    deduplicated `{nodes, links}` plus `members`, which maps each seed to the
+    node ids it contributed. Nodes listed in `known` come back as references,
+    as with `known` on /expand/person.
+    """
+    if max(len(payload.persons), len(payload.movies)) > EXPAND_BATCH_MAX_SEEDS:
+        raise HTTPException(status_code=422,
+                            detail=f"At most {EXPAND_BATCH_MAX_SEEDS} seeds per node type")
+    persons = [(s.id, max(1, min(s.limit or 200, 500))) for s in payload.persons]
+    movies = [(s.id, max(1, min(s.limit or 200, 200))) for s in payload.movies]
+    d3_data = await expand_batch(persons, movies)
+    if payload.known:
+        d3_data = delta(d3_data, set(payload.known))
+    return _render(request, d3_data)
+
+# Admin endpoints are off unless ADMIN_PASSWORD is set.
+ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+
+admin_security = HTTPBasic()
+
+
+def require_admin(credentials: HTTPBasicCredentials = Security(admin_security)):
+    if not ADMIN_PASSWORD:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    valid = (secrets.compare_digest(credentials.username.encode(), ADMIN_USERNAME.encode())
+             and secrets.compare_digest(credentials.password.encode(), ADMIN_PASSWORD.encode()))
+    if not valid:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            headers={"WWW-Authenticate": "Basic"})
+
+
+@api.post("/admin/schema/refresh", tags=['Admin'], dependencies=[Depends(require_admin)])
+async def refresh_schema():
+    """Sample the schema again now and rewrite the snapshot.
+
+    For after a manual change the data generation does not capture; a bump is
+    picked up within a minute without this.
+    """
+    await asyncio.to_thread(schema_store.refresh, await current_generation(), True)
+    return {"generation": schema_store.generation, "schema": schema_store.schema}
+
+
+@api.get("/admin/queries", tags=['Admin'], dependencies=[Depends(require_admin)])
+def get_queries(limit: int = 100, slow: bool = False, source: Optional[str] = None):
+    """The latest Neo4j statements with what the server reported for them,
+    newest first. `slow=true` keeps those over the slow-query threshold, which
+    carry a `profile` when they were sampled for PROFILE; `source` keeps one
+    caller (cypher_to_d3, entity_mapper, expand, enrich_with_betweenness).
+    """
+    limit = max(1, min(limit, query_log.entries.maxlen))
+    return {"slowQueryMs": SLOW_QUERY_MS,
+            "queries": query_log.recent(limit, slow_only=slow, source=source)}
@@ -0,0 +1,63 @@
+"""A small bounded LRU with a time-to-live, for per-process caches.
+
+Everything the API keeps between requests goes through this, so the limits are
+always explicit: a cache that only grows is a slow memory leak in a process
+that is meant to stay up for weeks. Entries are evicted least-recently-used
+first once `maxsize` is reached, and expire `ttl` seconds after they were
+stored whatever their use.
+
+Per process by design. With several uvicorn workers each holds its own copy;
+that costs a miss on whichever worker has not seen a key yet, never a wrong
+answer.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # Handlers run on the event loop, but a few callers live in worker
+        # threads (FastAPI runs plain `def` endpoints there), so every touch of
+        # the OrderedDict is serialised.
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -8,6 +8,8 @@ import os
 import time
 from dotenv import load_dotenv
 
+from app.services.generation import bump_generation
+
 load_dotenv()
 
 GRAPH_NAME = "imdb-graph"
@@ -366,6 +368,10 @@ if __name__ == "__main__":
 
         computer.show_statistics()
 
+        # Last, once every score is written: the API's caches hold results
+        # ordered by the old pageRank until this tells them otherwise.
+        bump_generation(computer.driver)
+
         print("\n" + "=" * 60)
         print(
             "✓ All centrality scores computed and stored successfully!"
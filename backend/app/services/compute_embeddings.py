@@ -10,6 +10,8 @@ from neo4j import GraphDatabase
 import os
 from dotenv import load_dotenv
 
+from app.services.generation import bump_generation
+
 load_dotenv()
 
 GRAPH_NAME = "imdb-embeddings"
@@ -163,6 +165,7 @@ if __name__ == "__main__":
 
         computer.compute_fastrp_embeddings(dimension=32)
         computer.show_statistics()
+        bump_generation(computer.driver)
 
         print("\n" + "=" * 60)
         print("All embeddings computed and stored successfully!")
@@ -30,6 +30,12 @@ from torch_geometric.data import Data
 from torch_geometric.loader import LinkNeighborLoader
 from torch_geometric.nn import SAGEConv
 
+try:
+    from app.services.generation import bump_generation
+except ImportError:
+    # Run as a plain script (see Usage): this file's directory is on sys.path.
+    from generation import bump_generation
+
 # ---------------------------------------------------------------------------
 # Constants
 # ---------------------------------------------------------------------------
@@ -382,6 +388,8 @@ class SageEmbeddingComputer:
                 written += len(batch_params)
 
         print(f"  Total written: {written:,}")
+        # Both push paths (push, all) end here, after the last batch commits.
+        bump_generation(self.driver)
 
     @staticmethod
     def _write_batch(session, params):
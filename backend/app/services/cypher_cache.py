@@ -0,0 +1,105 @@
+"""Question -> Cypher cache in front of the generation LLM call.
+
+The same few questions ("movies of Alfred Hitchcock") arrive hundreds of times
+a day, and each one used to pay a full LLM round trip to produce the Cypher it
+produced the time before. With temperature 0 the answer is a function of the
+prompt, so the key is exactly what goes into it: the normalised question, the
+schema, the template — and the model, since a different one writes different
+Cypher. Change any of those and the old entries simply stop matching. The cost
+guard's rules are in it too: an entry is stored only once its statement passed
+them, so a hit under the same rules need not be checked again.
+
+Two tiers. An in-memory LRU answers the hot questions, and an optional SQLite
+file (`CYPHER_CACHE_PATH`) lets entries survive a restart and be shared by every
+worker on the box. SQLite because it is in the standard library and already
+handles several processes writing one file.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from app.services.cache import TTLCache
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question):
+    """Fold away the differences that cannot change the generated Cypher.
+
+    Unicode form, runs of whitespace and trailing punctuation only. Case is
+    kept: names reach the prompt as the user typed them unless the entity
+    mapper corrected them, and the Cypher quotes them back verbatim.
+    """
+    if isinstance(question, list):
+        # A chat with history goes into the prompt whole, so it is keyed whole.
+        return json.dumps(
+            [{"role": m["role"], "content": normalize_question(m["content"])}
+             for m in question],
+            ensure_ascii=False,
+        )
+    text = unicodedata.normalize("NFC", str(question))
+    text = _WHITESPACE.sub(" ", text).strip()
+    return text.rstrip("?!. ")
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CypherCache:
+    def __init__(self, maxsize=2048, ttl=7 * 24 * 3600.0, path=None):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._db = None
+        self._lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cypher_cache ("
+                " key TEXT PRIMARY KEY, cypher TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(question, schema, template, model, guard_rules=""):
+        return _digest(json.dumps(
+            [normalize_question(question), _digest(schema), _digest(template), model,
+             guard_rules],
+            ensure_ascii=False,
+        ))
+
+    def get(self, key):
+        cypher = self.memory.get(key)
+        if cypher is not None or self._db is None:
+            return cypher
+        with self._lock:
+            row = self._db.execute(
+                "SELECT cypher FROM cypher_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        # Promote, so the next ask skips the disk too.
+        self.memory.set(key, row[0])
+        return row[0]
+
+    def set(self, key, cypher):
+        self.memory.set(key, cypher)
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cypher_cache (key, cypher, created) VALUES (?, ?, ?)",
+                (key, cypher, time.time()),
+            )
+            self._db.commit()
+
+
+cypher_cache = CypherCache(
+    maxsize=int(os.getenv("CYPHER_CACHE_SIZE", "2048")),
+    path=os.getenv("CYPHER_CACHE_PATH") or None,
+)
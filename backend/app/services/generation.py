@@ -0,0 +1,39 @@
+"""The data generation: one number that changes whenever the store's data does.
+
+Every cache the API keeps over Neo4j results is keyed on it. The offline jobs
+that rewrite what queries return — compute_centrality.py (pageRank ordering is
+in nearly every query), the two embedding jobs, and vps_import.sh (a whole new
+store) — bump it as their last step, and the API drops whatever it cached under
+the old value.
+
+It lives in the database, on a single `:DataGeneration` node, so that every
+worker and every job sees the same value without sharing a filesystem. The
+value is the epoch-millisecond time of the bump rather than a +1 counter:
+vps_import.sh replaces the store wholesale, and a counter restarting at 1 could
+coincide with a number some snapshot on disk was written under. A timestamp only
+ever moves forward.
+
+Importable without a live connection: the jobs use this with their own driver,
+and nothing here touches `graph.py`.
+"""
+
+GENERATION_LABEL = "DataGeneration"
+
+READ_GENERATION_CYPHER = f"""
+OPTIONAL MATCH (g:{GENERATION_LABEL} {{name: 'imdb'}})
+RETURN coalesce(g.value, 0) AS generation
+"""
+
+BUMP_GENERATION_CYPHER = f"""
+MERGE (g:{GENERATION_LABEL} {{name: 'imdb'}})
+SET g.value = timestamp()
+RETURN g.value AS generation
+"""
+
+
+def bump_generation(driver):
+    """Advance the generation; call once a job's writes are all committed."""
+    with driver.session() as session:
+        generation = session.run(BUMP_GENERATION_CYPHER).single()["generation"]
+    print(f"  data generation is now {generation}")
+    return generation
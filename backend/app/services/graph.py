@@ -1,11 +1,145 @@
+import asyncio
 import os
+import time
+from contextlib import asynccontextmanager
 
 # tag::graph[]
-#from langchain_community.graphs import Neo4jGraph
-from langchain_neo4j import Neo4jGraph
-
-enhanced_graph = Neo4jGraph(
-    url=os.getenv("NEO4J_URI", "neo4j://localhost:7687"),
-    username=os.getenv("NEO4J_USERNAME", "neo4j"),
-    password=os.getenv("NEO4J_PASSWORD"),
-    enhanced_schema=True)
\ No newline at end of file
+from neo4j import READ_ACCESS, AsyncGraphDatabase, Query, RoutingControl
+
+from app.services.generation import READ_GENERATION_CYPHER
+from app.services.query_log import query_log
+from app.services.timing import stage
+
+NEO4J_URI = os.getenv("NEO4J_URI", "neo4j://localhost:7687")
+NEO4J_USERNAME = os.getenv("NEO4J_USERNAME", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+NEO4J_DATABASE = os.getenv("NEO4J_DATABASE", "neo4j")
+
+# The request path runs on the async driver. `Neo4jGraph.query` is blocking, and
+# every FastAPI handler shares one event loop, so a single slow chat used to stall
+# every /expand queued behind it. The schema the Cypher prompt is built from
+# comes from a snapshot (see schema.py), not from sampling the store here.
+# Creating the driver opens no connection; the pool fills on first use.
+async_driver = AsyncGraphDatabase.driver(
+    NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+
+
+def _query(cypher, timeout):
+    # A server-side transaction timeout travels with the statement.
+    return Query(cypher, timeout=timeout) if timeout else cypher
+
+
+# The loop keeps only weak references to tasks; these hold the PROFILE runs.
+_profiles = set()
+
+
+def _log(source, cypher, params, summary, rows, timeout):
+    """Record the statement's summary; PROFILE it in the background if sampled."""
+    entry = query_log.record(source, cypher, params, summary, rows)
+    if query_log.claim_profile(entry):
+        task = asyncio.create_task(_profile(entry, cypher, params, timeout))
+        _profiles.add(task)
+        task.add_done_callback(_profiles.discard)
+
+
+async def _profile(entry, cypher, params, timeout):
+    try:
+        _, summary, _ = await async_driver.execute_query(
+            _query("PROFILE " + cypher, timeout),
+            parameters_=params or {},
+            database_=NEO4J_DATABASE,
+            routing_=RoutingControl.READ,
+        )
+        if summary.profile is not None:
+            query_log.attach_profile(entry, summary.profile)
+    except Exception as e:
+        # Diagnostics only: the request it came from has long been answered.
+        print(f"PROFILE of a slow query failed: {e!r}")
+    finally:
+        query_log.release()
+
+
+async def run_query(cypher, params=None, timeout=None, source=None):
+    """Run `cypher` and return its rows shaped like `Neo4jGraph.query`'s.
+
+    `Record.data()` is what LangChain calls too: a node becomes its property
+    dict, a relationship the `(start, type, end)` tuple `to_d3_format` expects,
+    so callers switching over see the same rows.
+
+    Routed as a read. Everything on the request path only reads, and on a
+    read-routed session the server refuses a write, which is the right answer
+    to LLM-generated Cypher that tries one.
+
+    `timeout`, in seconds, has the server abort the transaction past it.
+    `source` names the caller in the query log (see query_log.py).
+    """
+    with stage("neo4j"):
+        records, summary, _ = await async_driver.execute_query(
+            _query(cypher, timeout),
+            parameters_=params or {},
+            database_=NEO4J_DATABASE,
+            routing_=RoutingControl.READ,
+        )
+        rows = [record.data() for record in records]
+    _log(source, cypher, params, summary, len(rows), timeout)
+    return rows
+
+
+@asynccontextmanager
+async def stream_query(cypher, params=None, fetch_size=100, timeout=None, source=None,
+                       raw=False):
+    """Run `cypher` and iterate its rows as the server sends them.
+
+    For a caller that may not want them all: rows arrive `fetch_size` at a
+    time, and leaving the `async with` early discards the rest on the server
+    instead of pulling them over the wire. Rows are shaped as in `run_query`,
+    or with `raw` are the driver's own `Record`s, for a caller that reads
+    nodes and relationships in place rather than have them copied into dicts.
+
+        async with stream_query(cypher, params) as rows:
+            async for row in rows:
+                ...
+    """
+    async with async_driver.session(database=NEO4J_DATABASE,
+                                    default_access_mode=READ_ACCESS,
+                                    fetch_size=fetch_size) as session:
+        # Timed to the first batch; the rest arrive as the caller reads them.
+        with stage("neo4j"):
+            result = await session.run(_query(cypher, timeout), params or {})
+
+        count = 0
+
+        async def rows():
+            nonlocal count
+            async for record in result:
+                count += 1
+                yield record if raw else record.data()
+
+        try:
+            yield rows()
+        finally:
+            # The summary comes once the result is consumed; rows the caller
+            # left unread are discarded on the server, not fetched.
+            summary = await result.consume()
+            _log(source, cypher, params, summary, count, timeout)
+
+
+
+# How stale the API's idea of the generation may get. A bump lands at the end
+# of an offline job that ran for minutes to hours, so a few seconds of lag is
+# nothing, and it spares every cached request a round trip.
+GENERATION_POLL_SECONDS = float(os.getenv("GENERATION_POLL_SECONDS", "5"))
+
+_generation = None
+_generation_checked = 0.0
+
+
+async def current_generation():
+    """The data generation, re-read from Neo4j at most every few seconds."""
+    global _generation, _generation_checked
+    now = time.monotonic()
+    if _generation is None or now - _generation_checked >= GENERATION_POLL_SECONDS:
+        rows = await run_query(READ_GENERATION_CYPHER, source="generation")
+        _generation = rows[0]["generation"] if rows else 0
+        _generation_checked = now
+    return _generation
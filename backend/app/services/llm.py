@@ -3,17 +3,29 @@
 import os
 from dotenv import load_dotenv
 load_dotenv()
-from langchain_openai import ChatOpenAI
 
-llm = ChatOpenAI(model="gpt-4.1-mini",temperature=0,\
-                 api_key=os.getenv('OPENAI_API_KEY'))
-# end::llm[]
+from app.services.startup import startup_profile
 
-# tag::embedding[]
-# Create the Embedding model
-from langchain_openai import OpenAIEmbeddings
+LLM_MODEL = "gpt-4.1-mini"
 
-embeddings = OpenAIEmbeddings(
-    api_key=os.getenv('OPENAI_API_KEY')
-)
-# end::embedding[]
+# Created on first use rather than at import: langchain_openai and the openai
+# client behind it are a second of imports, which a worker that has only served
+# /expand so far never needed. LLM_MODEL is what the caches key on, so a cache
+# hit does not create it either.
+_llm = None
+
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        with startup_profile.timed("init llm"):
+            # tag::llm[]
+            from langchain_openai import ChatOpenAI
+            _llm = ChatOpenAI(model=LLM_MODEL,temperature=0,\
+                              api_key=os.getenv('OPENAI_API_KEY'))
+            # end::llm[]
+    return _llm
+
+
+def llm_ready():
+    return _llm is not None
@@ -0,0 +1,356 @@
+"""In-process store of the hot attributes of every scored node.
+
+The D3 payloads need a handful of attributes per node — label, year, the
+localised titles, the centralities — and used to get them only from whatever
+properties a query happened to return; anything missing meant another round
+trip (`enrich_with_betweenness`). This keeps those attributes in memory for
+every node that carries a `pageRank`, which is the few million that can ever
+reach a graph (see compute_centrality.py), so enrichment is a lookup.
+
+Compact on purpose. A dict per node would cost a few GB for 3M nodes; here each
+label is a table of parallel numpy arrays sorted by the numeric part of the
+IMDB id (`nm0000033` -> 33 in the `nm` table), found by binary search. Strings
+are one UTF-8 blob per column plus an offsets array, centralities are float32,
+the year an int16 with 0 for unknown — well under 200 bytes a node in all.
+
+Built from Neo4j in a background thread at startup, then written to a snapshot
+directory (`NODE_STORE_PATH`, by default backend/cache/node_store) that the
+next start — and every other worker — memory-maps instead: loading it is near
+instant and the pages are shared between processes. A snapshot remembers the
+data generation it was built under and is rebuilt once that moves on.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from neo4j import GraphDatabase
+
+from app.services.graph import (NEO4J_DATABASE, NEO4J_PASSWORD, NEO4J_URI,
+                                NEO4J_USERNAME, current_generation)
+from app.services.startup import startup_profile
+from app.services.tools.titles import LANGUAGES
+
+SNAPSHOT_VERSION = 1
+
+CENTRALITIES = (
+    "pageRank",
+    "eigenvectorCentrality",
+    "betweennessCentrality",
+    "degreeCentrality",
+)
+
+# id prefix -> (label, id property, label property, string columns). Movies
+# also carry the year and their alternative titles.
+TABLES = {
+    "nm": ("Person", "personId", "name", ("label",)),
+    "tt": ("Movie", "movieId", "title",
+           ("label", "original") + tuple(f"title_{lang}" for lang in LANGUAGES)),
+}
+
+LOAD_CYPHER = """
+MATCH (n:{label})
+WHERE n.pageRank IS NOT NULL
+RETURN n.{id_property} AS id, n.{label_property} AS label,
+       n.year AS year, n.originalTitle AS original,
+       {titles}
+       n.pageRank AS pageRank,
+       n.eigenvectorCentrality AS eigenvectorCentrality,
+       n.betweennessCentrality AS betweennessCentrality,
+       n.degreeCentrality AS degreeCentrality
+"""
+
+
+def _split_id(node_id):
+    """`nm0000033` -> ("nm", 33); None for anything that is not an IMDB id."""
+    prefix, digits = node_id[:2], node_id[2:]
+    if prefix not in TABLES or not digits.isdigit():
+        return None
+    return prefix, int(digits)
+
+
+def _year(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _float(value):
+    # float32 holds about seven significant digits; print no more than that,
+    # or 0.1 comes back out as 0.10000000149011612.
+    return float(f"{value:.7g}")
+
+
+class StringColumn:
+    """Many strings as one UTF-8 blob plus offsets. '' stands for missing."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def build(cls, values):
+        encoded = [(v or "").encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(offsets, blob)
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.blob[start:end].tobytes().decode("utf-8") if end > start else None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.blob.nbytes
+
+
+class NodeTable:
+    """One label's nodes: parallel arrays, sorted by numeric id."""
+
+    def __init__(self, keys, strings, year, centralities):
+        self.keys = keys
+        self.strings = strings
+        self.year = year
+        self.centralities = centralities
+
+    @classmethod
+    def build(cls, columns, string_columns):
+        """From column lists as `_build_from_neo4j` collects them, in any order."""
+        order = np.argsort(np.asarray(columns["key"], dtype=np.int64), kind="stable")
+        keys = np.asarray(columns["key"], dtype=np.int64)[order]
+        strings = {c: StringColumn.build([columns[c][i] for i in order])
+                   for c in string_columns}
+        year = np.fromiter((_year(v) for v in columns["year"]), dtype=np.int16,
+                           count=len(order))[order]
+        centralities = {
+            c: np.array([np.nan if v is None else v for v in columns[c]],
+                        dtype=np.float32)[order]
+            for c in CENTRALITIES
+        }
+        return cls(keys, strings, year, centralities)
+
+    def index(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return None
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return (self.keys.nbytes + self.year.nbytes
+                + sum(c.nbytes for c in self.strings.values())
+                + sum(a.nbytes for a in self.centralities.values()))
+
+    # -- snapshot ------------------------------------------------------------
+
+    def arrays(self):
+        yield "keys", self.keys
+        yield "year", self.year
+        for name, column in self.strings.items():
+            yield f"{name}.offsets", column.offsets
+            yield f"{name}.blob", column.blob
+        for name, values in self.centralities.items():
+            yield name, values
+
+    @classmethod
+    def load(cls, directory, prefix, string_columns):
+        def array(name):
+            return np.load(os.path.join(directory, f"{prefix}.{name}.npy"), mmap_mode="r")
+
+        strings = {c: StringColumn(array(f"{c}.offsets"), array(f"{c}.blob"))
+                   for c in string_columns}
+        centralities = {c: array(c) for c in CENTRALITIES}
+        return cls(array("keys"), strings, array("year"), centralities)
+
+
+class NodeStore:
+    def __init__(self, path):
+        self.path = path
+        self.tables = None
+        self.generation = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.tables is not None
+
+    def lookup(self, node_id):
+        """The hot attributes of `node_id`, or None if it is not stored.
+
+        Shaped like the node fields of the D3 payload, so a caller can merge
+        them straight in.
+        """
+        tables = self.tables
+        split = _split_id(node_id) if tables else None
+        if split is None:
+            return None
+        prefix, key = split
+        table = tables[prefix]
+        i = table.index(key)
+        if i is None:
+            return None
+
+        attrs = {"label": table.strings["label"][i]}
+        if prefix == "tt":
+            if table.year[i]:
+                attrs["year"] = str(int(table.year[i]))
+            titles = {lang: table.strings[f"title_{lang}"][i] for lang in LANGUAGES}
+            titles = {lang: t for lang, t in titles.items() if t}
+            original = table.strings["original"][i]
+            if original and original != attrs["label"]:
+                titles["original"] = original
+            if titles:
+                attrs["titles"] = titles
+        for name, values in table.centralities.items():
+            if not np.isnan(values[i]):
+                attrs[name] = _float(values[i])
+        return attrs
+
+    def enrich(self, nodes, fields=("year", "titles", "betweennessCentrality")):
+        """Fill `fields` into D3 nodes that lack them. Never overwrites."""
+        if not self.ready:
+            return nodes
+        for node in nodes:
+            attrs = self.lookup(node["id"])
+            if attrs is None:
+                continue
+            for field in fields:
+                if field not in node and field in attrs:
+                    node[field] = attrs[field]
+        return nodes
+
+    def stats(self):
+        tables = self.tables or {}
+        return {
+            "ready": self.ready,
+            "generation": self.generation,
+            "nodes": {TABLES[p][0]: len(t) for p, t in tables.items()},
+            "bytes": sum(t.nbytes for t in tables.values()),
+        }
+
+    # -- building ------------------------------------------------------------
+
+    def _build_from_neo4j(self):
+        tables = {}
+        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+        try:
+            for prefix, (label, id_property, label_property, columns) in TABLES.items():
+                titles = "".join(f"n.title_{lang} AS title_{lang}, " for lang in LANGUAGES)
+                cypher = LOAD_CYPHER.format(
+                    label=label, id_property=id_property,
+                    label_property=label_property,
+                    titles=titles if prefix == "tt" else "",
+                )
+                # Column lists, not a dict per row: at 3M rows the dicts alone
+                # would outweigh the finished table many times over.
+                fields = ("key", "year") + columns + CENTRALITIES
+                collected = {f: [] for f in fields}
+                with driver.session(database=NEO4J_DATABASE, fetch_size=10_000) as session:
+                    for record in session.run(cypher):
+                        split = _split_id(record["id"] or "")
+                        if split is None:
+                            continue
+                        collected["key"].append(split[1])
+                        for f in fields[1:]:
+                            collected[f].append(record[f])
+                tables[prefix] = NodeTable.build(collected, columns)
+                del collected
+        finally:
+            driver.close()
+        return tables
+
+    def _save(self, tables, generation):
+        tmp = f"{self.path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for prefix, table in tables.items():
+            for name, array in table.arrays():
+                np.save(os.path.join(tmp, f"{prefix}.{name}.npy"), array)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "generation": generation,
+                       "nodes": {p: len(t) for p, t in tables.items()}}, f)
+        # The swap is two renames: the old snapshot aside, the new one in. A
+        # crash between them leaves the old one at `.old`, which `warm` puts
+        # back. Readers that already mapped the old files keep them until they
+        # let go, removed or not.
+        old = f"{self.path}.old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.replace(self.path, old)
+        os.replace(tmp, self.path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def _load_snapshot(self, generation):
+        try:
+            with open(os.path.join(self.path, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != SNAPSHOT_VERSION or meta.get("generation") != generation:
+            return None
+        return {prefix: NodeTable.load(self.path, prefix, columns)
+                for prefix, (_, _, _, columns) in TABLES.items()}
+
+    def warm(self, generation):
+        """Make the store current for `generation`: snapshot if one fits, else build.
+
+        Blocking — run it in a thread. Workers starting together serialise on a
+        lock file, so one builds and the rest map what it wrote.
+        """
+        with self._lock:
+            if self.generation == generation and self.ready:
+                return
+            started = time.monotonic()
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(f"{self.path}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not os.path.exists(self.path) and os.path.exists(f"{self.path}.old"):
+                    os.replace(f"{self.path}.old", self.path)  # a swap cut short
+                tables = self._load_snapshot(generation)
+                source = "snapshot"
+                if tables is None:
+                    tables = self._build_from_neo4j()
+                    self._save(tables, generation)
+                    source = "neo4j"
+            self.tables, self.generation = tables, generation
+            startup_profile.record("warm node store", time.monotonic() - started)
+            stats = self.stats()
+            print(f"Node store: {stats['nodes']} from {source},"
+                  f" {stats['bytes'] / 2**20:.0f} MiB,"
+                  f" {time.monotonic() - started:.1f}s")
+
+    async def keep_warm(self, interval=60.0):
+        """Background task: warm now, then follow the data generation."""
+        while True:
+            try:
+                generation = await current_generation()
+                if generation != self.generation or not self.ready:
+                    await asyncio.to_thread(self.warm, generation)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The store is an optimisation; without it enrichment falls
+                # back to querying. Try again next round.
+                print(f"Node store warm-up failed: {e!r}")
+            await asyncio.sleep(interval)
+
+
+# backend/cache, which .gitignore keeps out of the repository, wherever the
+# server was started from.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), "cache")
+
+node_store = NodeStore(os.getenv("NODE_STORE_PATH", os.path.join(CACHE_DIR, "node_store")))
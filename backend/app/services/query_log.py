@@ -0,0 +1,135 @@
+"""What each Neo4j statement cost: a ring buffer, a rotating log, PROFILEs.
+
+The driver hands back a result summary with every query — how long the server
+took to the first row and to the last — and the request path threw it away,
+so there was no telling which generated statements were the expensive ones.
+`run_query` and `stream_query` now pass it here with the statement, its
+parameters, the row count and which code ran it.
+
+- The last `QUERY_LOG_SIZE` entries stay in memory for GET /admin/queries.
+- Each entry is also a JSON line in `QUERY_LOG_PATH` (by default
+  backend/cache/query_log.jsonl, wherever the server was started from),
+  rotated at `QUERY_LOG_MAX_BYTES` with `QUERY_LOG_BACKUPS` old files kept. An
+  empty path keeps the log in memory only.
+- A statement slower than `SLOW_QUERY_MS` (available + consumed) is slow. A
+  `PROFILE_SAMPLE_RATE` share of slow statements is run again under PROFILE,
+  in the background and one at a time, so a burst of slow queries does not
+  double the load that made them slow; the operator tree, with rows and db
+  hits per operator, is attached to the entry when it arrives.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# backend/cache, which .gitignore keeps out of the repository.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), "cache")
+
+QUERY_LOG_SIZE = int(os.getenv("QUERY_LOG_SIZE", "1000"))
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", os.path.join(CACHE_DIR, "query_log.jsonl"))
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(10 * 2**20)))
+QUERY_LOG_BACKUPS = int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "1000"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.1"))
+
+# Parameters can be long lists of ids; the log keeps their start.
+PARAMS_MAX_CHARS = 500
+
+
+def _params_text(params):
+    text = json.dumps(params or {}, ensure_ascii=False, default=str)
+    return text if len(text) <= PARAMS_MAX_CHARS else text[:PARAMS_MAX_CHARS] + "..."
+
+
+def _operator(plan):
+    """A profiled plan, kept to what says where the work went."""
+    arguments = plan.get("arguments", {})
+    return {
+        "operatorType": plan.get("operatorType", "").split("@")[0],
+        "rows": plan.get("rows", arguments.get("Rows")),
+        "dbHits": plan.get("dbHits", arguments.get("DbHits")),
+        "estimatedRows": arguments.get("EstimatedRows"),
+        "children": [_operator(child) for child in plan.get("children", [])],
+    }
+
+
+def _db_hits(operator):
+    return (operator["dbHits"] or 0) + sum(_db_hits(c) for c in operator["children"])
+
+
+class QueryLog:
+    def __init__(self, size=QUERY_LOG_SIZE, path=QUERY_LOG_PATH):
+        self.entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._profiling = False
+        self._logger = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=QUERY_LOG_MAX_BYTES, backupCount=QUERY_LOG_BACKUPS,
+                encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger("app.query_log")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.addHandler(handler)
+
+    def _write(self, record):
+        if self._logger is not None:
+            self._logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def record(self, source, cypher, params, summary, rows):
+        """Log one executed statement. Returns its entry."""
+        available = getattr(summary, "result_available_after", None)
+        consumed = getattr(summary, "result_consumed_after", None)
+        total = (available or 0) + (consumed or 0)
+        entry = {
+            "at": round(time.time(), 3),
+            "source": source or "other",
+            "cypher": cypher,
+            "params": _params_text(params),
+            "rows": rows,
+            "availableAfterMs": available,
+            "consumedAfterMs": consumed,
+            "slow": total >= SLOW_QUERY_MS,
+        }
+        with self._lock:
+            self.entries.append(entry)
+        self._write({"event": "query", **entry})
+        return entry
+
+    def claim_profile(self, entry):
+        """Whether to PROFILE `entry`'s statement now; the caller must `release`."""
+        if not entry["slow"] or random.random() >= PROFILE_SAMPLE_RATE:
+            return False
+        with self._lock:
+            if self._profiling:
+                return False
+            self._profiling = True
+            return True
+
+    def attach_profile(self, entry, plan):
+        operators = _operator(plan)
+        entry["profile"] = {"dbHits": _db_hits(operators), "plan": operators}
+        self._write({"event": "profile", "at": entry["at"], "source": entry["source"],
+                     "cypher": entry["cypher"], **entry["profile"]})
+
+    def release(self):
+        self._profiling = False
+
+    def recent(self, limit=100, slow_only=False, source=None):
+        """Newest first."""
+        with self._lock:
+            entries = list(self.entries)
+        entries = [e for e in reversed(entries)
+                   if (not slow_only or e["slow"]) and (source is None or e["source"] == source)]
+        return entries[:limit]
+
+
+query_log = QueryLog()
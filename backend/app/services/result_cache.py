@@ -0,0 +1,52 @@
+"""Neo4j result cache, keyed by Cypher text + parameters + data generation.
+
+The same generated statement often runs again seconds later — the same popular
+question from another user, or the cypher cache handing back a known statement.
+Each run still cost a trip to a 25M-node store. Results are a pure function of
+(statement, parameters, data), so they are cached on exactly that, with the
+data half stood in for by the generation (see generation.py). When a job bumps
+it, every entry keyed on the old value becomes unreachable and the whole cache
+is dropped at once rather than left to age out.
+
+Holds whatever a caller derives from a result — the chat path keeps the
+finished D3 payload, the expand endpoints theirs — under separate `kind`s so
+they never collide.
+Cached values are shared between requests: treat them as read-only.
+"""
+
+import json
+import os
+
+from app.services.cache import TTLCache
+from app.services.graph import current_generation
+
+result_cache = TTLCache(
+    maxsize=int(os.getenv("RESULT_CACHE_SIZE", "512")),
+    # Correctness comes from the generation; the TTL only bounds how long a
+    # result nobody asks for again holds on to memory.
+    ttl=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "1800")),
+)
+
+_cached_generation = None
+
+
+def _params_key(params):
+    return json.dumps(params or {}, sort_keys=True, default=str)
+
+
+async def result_key(kind, text, params=None):
+    """The cache key for a result under the current generation.
+
+    `text` is the Cypher statement, or for a `kind` that is not one (an expand
+    endpoint, say) whatever identifies the result within it.
+
+    Reading the generation here is also where a bump is noticed: the first
+    lookup after one clears everything cached under the old value.
+    """
+    global _cached_generation
+    generation = await current_generation()
+    if generation != _cached_generation:
+        result_cache.clear()
+        _cached_generation = generation
+    return (kind, generation, text, _params_key(params))
+
@@ -0,0 +1,125 @@
+"""The graph schema the Cypher prompt is built from, kept as an on-disk snapshot.
+
+`Neo4jGraph(enhanced_schema=True)` used to sample the whole store at import
+time: every container restart and every `--reload` waited on it, and an API
+started while Neo4j was briefly down did not start at all. The schema only
+changes when the data does, so it is computed once per data generation and
+written to `SCHEMA_SNAPSHOT_PATH`. A process starting up reads that file and is
+ready at once; `keep_fresh` recomputes it in the background when the generation
+moves on, and `/admin/schema/refresh` forces it.
+
+The snapshot holds the formatted schema string and the structured schema it was
+formatted from, under the generation it was sampled at.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+from neo4j import GraphDatabase
+from neo4j_graphrag.schema import format_schema, get_structured_schema
+
+from app.services.generation import GENERATION_LABEL
+from app.services.graph import (NEO4J_DATABASE, NEO4J_PASSWORD, NEO4J_URI,
+                                NEO4J_USERNAME, current_generation)
+from app.services.startup import startup_profile
+
+SNAPSHOT_VERSION = 1
+
+
+class SchemaStore:
+    def __init__(self, path):
+        self.path = path
+        self.schema = None
+        self.structured = None
+        self.generation = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.schema is not None
+
+    def load(self):
+        """Take the snapshot on disk, whatever generation it is for.
+
+        A schema one generation old is still far better than none; `keep_fresh`
+        replaces it as soon as it can reach the database.
+        """
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return False
+        self.schema = snapshot["schema"]
+        self.structured = snapshot["structured"]
+        self.generation = snapshot["generation"]
+        return True
+
+    def _sample(self):
+        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+        try:
+            structured = get_structured_schema(driver, is_enhanced=True,
+                                               database=NEO4J_DATABASE)
+        finally:
+            driver.close()
+        # The generation marker is bookkeeping, not data; the LLM has no
+        # business seeing it in the schema it writes Cypher against.
+        structured.get("node_props", {}).pop(GENERATION_LABEL, None)
+        return structured
+
+    def _save(self):
+        tmp = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "generation": self.generation,
+                       "schema": self.schema, "structured": self.structured}, f)
+        os.replace(tmp, self.path)
+
+    def refresh(self, generation, force=False):
+        """Sample the schema for `generation` and snapshot it. Blocking."""
+        with self._lock:
+            if not force and self.ready and self.generation == generation:
+                return
+            started = time.monotonic()
+            structured = self._sample()
+            self.structured = structured
+            self.schema = format_schema(structured, True)
+            self.generation = generation
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._save()
+            print(f"Schema sampled for generation {generation},"
+                  f" {time.monotonic() - started:.1f}s")
+
+    async def current(self):
+        """The schema text. Only the very first start, with no snapshot yet,
+        waits for it to be sampled."""
+        if not self.ready:
+            await asyncio.to_thread(self.refresh, await current_generation())
+        return self.schema
+
+    async def keep_fresh(self, interval=60.0):
+        """Background task: follow the data generation."""
+        while True:
+            try:
+                generation = await current_generation()
+                if generation != self.generation or not self.ready:
+                    await asyncio.to_thread(self.refresh, generation)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep serving the schema already held; try again next round.
+                print(f"Schema refresh failed: {e!r}")
+            await asyncio.sleep(interval)
+
+
+# backend/cache, which .gitignore keeps out of the repository, wherever the
+# server was started from.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), "cache")
+
+schema_store = SchemaStore(os.getenv("SCHEMA_SNAPSHOT_PATH", os.path.join(CACHE_DIR, "schema.json")))
+with startup_profile.timed("load schema snapshot"):
+    schema_store.load()
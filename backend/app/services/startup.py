@@ -0,0 +1,91 @@
+"""Where the API process spends its start-up time.
+
+Import this first. From then on every module import is timed — inclusive of
+what it imports in turn — and the lazily created clients add their own
+initialisation time with `startup_profile.timed(...)`. GET /ready shows the
+result, slowest first, so a dependency that makes cold starts slow is visible
+without reaching for `python -X importtime`.
+"""
+
+import importlib.abc
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Imports quicker than this are left out of the report; there are hundreds.
+REPORT_MIN_SECONDS = 0.005
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            # First time only: a re-import after a failure is not start-up.
+            self.timings.setdefault(name, seconds)
+
+    @contextmanager
+    def timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def report(self):
+        with self._lock:
+            timings = sorted(self.timings.items(), key=lambda t: -t[1])
+        return {
+            "sinceStart": round(time.perf_counter() - self.started, 3),
+            "timings": {name: round(seconds, 3) for name, seconds in timings
+                        if seconds >= REPORT_MIN_SECONDS},
+        }
+
+
+startup_profile = StartupProfile()
+
+
+def _tracked(name):
+    # Top-level packages and this app's own modules; a package's submodules
+    # are already inside its time.
+    return "." not in name or name.startswith("app.")
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    """Finds nothing itself: asks the real finders, then times the loading."""
+
+    def find_spec(self, name, path, target=None):
+        if not _tracked(name):
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        exec_module = getattr(loader, "exec_module", None)
+        # Built-in and frozen modules are loaded by the importer class itself;
+        # patching that would time every later import under this name.
+        if exec_module is None or isinstance(loader, type):
+            return spec
+
+        def timed_exec_module(module):
+            with startup_profile.timed(f"import {name}"):
+                exec_module(module)
+
+        try:
+            loader.exec_module = timed_exec_module
+        except AttributeError:  # a loader that will not take it goes untimed
+            pass
+        return spec
+
+
+if not any(isinstance(f, _TimingFinder) for f in sys.meta_path):
+    sys.meta_path.insert(0, _TimingFinder())
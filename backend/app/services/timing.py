@@ -0,0 +1,80 @@
+"""Where a request's time went, stage by stage.
+
+The chat path used to say only "Generated Cypher" and "Returned N records" on
+stdout, which tells you nothing about why the slow one was slow. Code on the
+request path marks its stages:
+
+    with stage("neo4j"):
+        records = await ...
+
+and the API middleware starts a `Timings` for each /chat and /expand request,
+sends what was collected back as a `Server-Timing` header (browser devtools
+show it in the request's Timing tab), while every stage also lands in the
+`request_stage_seconds` histogram on GET /metrics.
+
+The timings live in a context variable, so concurrent requests never mix, and
+tasks a request spawns (an `asyncio.gather`) add to their request's. The
+outermost open stage wins: the Neo4j round trip inside the full-text lookup is
+part of "match", not counted again as "neo4j", and stages run side by side
+under one parent are timed once, by the parent. Outside a request a stage
+costs a context variable read and records nothing.
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+from app.services.metrics import Histogram
+
+stage_seconds = Histogram("request_stage_seconds",
+                          "Time spent in each stage of a request",
+                          labels=("route", "stage"))
+
+_timings = contextvars.ContextVar("request_timings", default=None)
+_open_stage = contextvars.ContextVar("open_stage", default=None)
+
+
+class Timings:
+    def __init__(self, route):
+        self.route = route
+        self.stages = {}  # name -> seconds, summed over repeats, in first-seen order
+
+    def add(self, name, seconds, observe=True):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if observe:
+            stage_seconds.observe(seconds, self.route, name)
+
+    def header(self):
+        """The `Server-Timing` value: one `name;dur=<ms>` per stage."""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}"
+                         for name, seconds in self.stages.items())
+
+
+def start_timings(route):
+    """Collect the stages of the current request (and the tasks it starts)."""
+    timings = Timings(route)
+    _timings.set(timings)
+    return timings
+
+
+def record_stage(name, seconds):
+    """Add time measured by the caller, for work that is not one block: the
+    D3 conversion interleaved with the fetch it consumes, say."""
+    timings = _timings.get()
+    if timings is not None and _open_stage.get() is None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    timings = _timings.get()
+    if timings is None or _open_stage.get() is not None:
+        yield
+        return
+    token = _open_stage.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _open_stage.reset(token)
+        timings.add(name, time.perf_counter() - started)
@@ -1,8 +1,15 @@
-from langchain_neo4j import GraphCypherQAChain
+from langchain_neo4j import GraphCypherQAChain, Neo4jGraph
 from langchain.prompts.prompt import PromptTemplate
 
-from app.services.llm import llm
-from app.services.graph import enhanced_graph as graph
+from app.services.llm import get_llm
+from app.services.graph import NEO4J_PASSWORD, NEO4J_URI, NEO4J_USERNAME
+from app.services.schema import schema_store
+
+# Schema from the snapshot rather than sampled again (see schema.py).
+graph = Neo4jGraph(url=NEO4J_URI, username=NEO4J_USERNAME, password=NEO4J_PASSWORD,
+                   enhanced_schema=True, refresh_schema=False)
+graph.schema = schema_store.schema or ""
+graph.structured_schema = schema_store.structured or {}
 
 CYPHER_GENERATION_TEMPLATE = """Task:Generate Cypher statement to query a graph database.
 Instructions:
@@ -66,7 +73,7 @@ CYPHER_GENERATION_PROMPT = PromptTemplate(
 
 
 cypher_qa = GraphCypherQAChain.from_llm(
-    llm=llm, 
+    llm=get_llm(), 
     graph=graph, 
     verbose=True,
     allow_dangerous_requests=True,
@@ -0,0 +1,166 @@
+"""Cost guard for LLM-generated Cypher: EXPLAIN it before anything runs it.
+
+Appending `LIMIT 60` was the only protection, and a limit applies to what comes
+out, not to what the plan does getting there. An unbounded
+`shortestPath((a)-[*]-(b))`, a cartesian product of two label scans, or a
+label-less MATCH over 25M nodes all carry a LIMIT and still tie up the store.
+
+EXPLAIN compiles without executing, so the plan is checked against:
+
+- `GUARD_FORBIDDEN_OPERATORS`: operators never acceptable here (an
+  AllNodesScan is a pattern without a label);
+- `GUARD_MAX_ESTIMATED_ROWS`: the planner's row estimate for any one operator.
+  Generous by default — the prompt's own examples scan a label and sort by
+  pageRank — so it catches the multiplicative blow-ups, not ordinary scans;
+- `GUARD_MAX_HOPS`: variable-length patterns need an upper bound no greater
+  than this, and so do the quantifiers of quantified path patterns
+  (`((a)-[:R]->(b)){1,3}`) and quantified relationships (`-[:R]->{1,3}`),
+  where `+`, `*` and `{1,}` are unbounded. Read from the text: the plan shows
+  the bound only in free-form details that differ between server versions.
+
+A rejection comes back as a reason written for the LLM, which gets it with
+its statement and tries again (see cypher_to_d3).
+"""
+
+import json
+import os
+import re
+
+from neo4j import RoutingControl
+from neo4j.exceptions import ClientError
+
+from app.services.graph import NEO4J_DATABASE, async_driver
+from app.services.timing import stage
+
+GUARD_FORBIDDEN_OPERATORS = frozenset(
+    op.strip() for op in
+    os.getenv("GUARD_FORBIDDEN_OPERATORS", "AllNodesScan,CartesianProduct").split(",")
+    if op.strip()
+)
+GUARD_MAX_ESTIMATED_ROWS = float(os.getenv("GUARD_MAX_ESTIMATED_ROWS", "100000000"))
+GUARD_MAX_HOPS = int(os.getenv("GUARD_MAX_HOPS", "4"))
+# Bumped when the checks themselves change, so verdicts cached under the
+# old ones are not trusted.
+GUARD_VERSION = 2
+# Everything a verdict depends on besides the statement. Part of the Cypher
+# cache key, so a cached statement is one these very rules already passed.
+GUARD_RULES = json.dumps([GUARD_VERSION, sorted(GUARD_FORBIDDEN_OPERATORS),
+                          GUARD_MAX_ESTIMATED_ROWS, GUARD_MAX_HOPS])
+
+# The `*...` of a relationship pattern: `[*]`, `[r:ACTED_IN*2]`, `[*1..3]`, `[*..]`.
+_VAR_LENGTH = re.compile(r"\[[^\]]*?\*\s*(\d+)?\s*(\.\.)?\s*(\d+)?\s*\]")
+# A quantifier: `{2}`, `{1,3}`, `{1,}`, `{,3}`, `+`, `*`.
+_QUANTIFIER = re.compile(r"\{\s*(\d*)\s*(,)?\s*(\d*)\s*\}|\+|\*")
+# The end of a relationship pattern a quantifier may follow: `]-`, `]->`.
+_RELATIONSHIP_END = re.compile(r"\]\s*-\s*>?\s*")
+# What makes a parenthesised group a path pattern rather than arithmetic.
+_RELATIONSHIP = re.compile(r"-\s*\[|\]\s*-|-->|<--|--")
+_STRING = re.compile(r"'(?:\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\"")
+
+
+class CypherRejected(Exception):
+    """A statement the guard would not let through, after every retry."""
+
+    def __init__(self, reason, cypher):
+        super().__init__(reason)
+        self.reason = reason
+        self.cypher = cypher
+
+
+def _hops_violation(cypher):
+    for match in _VAR_LENGTH.finditer(cypher):
+        low, dots, high = match.groups()
+        upper = high if dots else low
+        if upper is None:
+            return (f"the variable-length pattern `{match.group(0)}` has no upper "
+                    f"bound; give it one of at most {GUARD_MAX_HOPS}, e.g. *1..{GUARD_MAX_HOPS}")
+        if int(upper) > GUARD_MAX_HOPS:
+            return (f"the variable-length pattern `{match.group(0)}` may go "
+                    f"{upper} hops; at most {GUARD_MAX_HOPS} are allowed")
+    return None
+
+
+def _quantifiers(cypher):
+    """The quantifiers of the statement's quantified path patterns and
+    relationships, as regex matches."""
+    text = _STRING.sub("''", cypher)
+    opened = []
+    for i, c in enumerate(text):
+        if c == "(":
+            opened.append(i)
+        elif c == ")" and opened:
+            start = opened.pop()
+            # `(x) * 2` is arithmetic: a group only quantifies a path.
+            if _RELATIONSHIP.search(text, start, i):
+                after = i + 1
+                while after < len(text) and text[after].isspace():
+                    after += 1
+                match = _QUANTIFIER.match(text, after)
+                if match:
+                    yield match
+    for end in _RELATIONSHIP_END.finditer(text):
+        match = _QUANTIFIER.match(text, end.end())
+        if match:
+            yield match
+
+
+def _quantifier_violation(cypher):
+    for match in _quantifiers(cypher):
+        low, comma, high = match.groups()
+        upper = (high if comma else low) or None
+        if upper is None:
+            return (f"the quantifier `{match.group(0)}` has no upper bound; give it "
+                    f"one of at most {GUARD_MAX_HOPS}, e.g. {{1,{GUARD_MAX_HOPS}}}")
+        if int(upper) > GUARD_MAX_HOPS:
+            return (f"the quantifier `{match.group(0)}` may repeat {upper} times; "
+                    f"at most {GUARD_MAX_HOPS} are allowed")
+    return None
+
+
+def _operators(plan):
+    yield plan
+    for child in plan.get("children", []):
+        yield from _operators(child)
+
+
+def _plan_violation(plan):
+    for operator in _operators(plan):
+        # Neo4j 5 suffixes the runtime: "AllNodesScan@neo4j".
+        name = operator.get("operatorType", "").split("@")[0]
+        if name in GUARD_FORBIDDEN_OPERATORS:
+            if name == "AllNodesScan":
+                return "it scans every node in the graph; give every node pattern a label"
+            if name == "CartesianProduct":
+                return ("it builds a cartesian product of unconnected patterns; "
+                        "connect them through relationships")
+            return f"its plan uses the {name} operator, which is not allowed"
+        estimated = operator.get("arguments", {}).get("EstimatedRows", 0)
+        if estimated > GUARD_MAX_ESTIMATED_ROWS:
+            return (f"the planner expects {name} to produce about {estimated:,.0f} "
+                    f"rows; narrow the match with labels, properties or a WHERE")
+    return None
+
+
+async def check_cypher(cypher, params=None):
+    """Why `cypher` must not run, or None if it may.
+
+    Static checks first; then one EXPLAIN round trip, which also catches a
+    statement that does not compile, reported the way Neo4j words it.
+    """
+    reason = _hops_violation(cypher) or _quantifier_violation(cypher)
+    if reason is not None:
+        return reason
+    try:
+        with stage("guard"):
+            _, summary, _ = await async_driver.execute_query(
+                "EXPLAIN " + cypher,
+                parameters_=params or {},
+                database_=NEO4J_DATABASE,
+                routing_=RoutingControl.READ,
+            )
+    except ClientError as e:
+        message = e.message or str(e)
+        return f"Neo4j cannot compile it: {message}"
+    if summary.plan is None:
+        return None
+    return _plan_violation(summary.plan)
@@ -0,0 +1,178 @@
+"""Lift the literals out of generated Cypher, so Neo4j can reuse its plans.
+
+The LLM writes values inline — `{title: "Titanic"}`, `m.year >= "2000"` — and
+Neo4j caches plans by statement text, so every question compiled a plan of its
+own, on the critical path, even when it differed from the last one only in a
+name. `parameterize` rewrites each string and number literal to `$lit<i>`,
+numbered in order of appearance, and returns the values as parameters: the
+Titanic question and the Vertigo question become the same text and share one
+plan.
+
+Left as written: LIMIT and SKIP counts (every statement ends `LIMIT 60`
+anyway, and the cost guard reads them), the bounds of a variable-length
+pattern like `[*1..3]` or of a quantified path pattern like `{1,3}` (which
+cannot be parameters), and anything inside comments or backquoted names.
+Hexadecimal and octal numbers (`0x1F`, `0o17`) and floats written with a
+leading dot (`.5`) are lifted whole. A statement the scanner cannot read — an
+unterminated string — is returned unchanged.
+
+Neo4j does not report plan-cache hits to a client, so `plan_cache` estimates
+them: a statement counts as a hit when its text is among the last
+`CYPHER_QUERY_CACHE_SIZE` distinct texts run (the server's
+`server.db.query_cache_size`, 1000 by default).
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from app.services.metrics import Counter, Gauge
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_NUMBER = re.compile(r"0[xX][0-9a-fA-F]+|0o[0-7]+"
+                     r"|(?:\d+(?:\.\d+)?|\.\d+)(?:[eE][+-]?\d+)?")
+# `*`, `*2`, `*1..3`, `*..` — copied verbatim, digits and all.
+_VAR_LENGTH = re.compile(r"\*\s*\d*\s*(?:\.\.\s*\d*)?")
+# A quantified path pattern's `{2}`, `{1,3}`, `{1,}`, `{,3}`: a map always has
+# keys, so braces holding only digits and a comma are a quantifier.
+_QUANTIFIER = re.compile(r"\{\s*\d*\s*(?:,\s*\d*\s*)?\}")
+# What may come right before a number, so that the `.5` of `> .5` is one and
+# the `.2` of a `[1..2]` slice is not.
+_BEFORE_NUMBER = frozenset(" \t\r\n(,[{=<>+-*/%^:")
+_COUNT_CLAUSE = re.compile(r"\b(?:LIMIT|SKIP)\s*$", re.IGNORECASE)
+
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f",
+            "\\": "\\", "'": "'", '"': '"'}
+
+
+def _read_string(text, start):
+    """The string literal opening at `start`: `(end, value)`, None if unterminated."""
+    quote = text[start]
+    chars = []
+    i = start + 1
+    while i < len(text):
+        c = text[i]
+        if c == quote:
+            return i + 1, "".join(chars)
+        if c == "\\" and i + 1 < len(text):
+            nxt = text[i + 1]
+            if nxt == "u" and i + 6 <= len(text):
+                chars.append(chr(int(text[i + 2:i + 6], 16)))
+                i += 6
+                continue
+            chars.append(_ESCAPES.get(nxt, nxt))
+            i += 2
+            continue
+        chars.append(c)
+        i += 1
+    return None
+
+
+def parameterize(cypher, params=None, prefix="lit"):
+    """`(cypher, params)` with every liftable literal replaced by a parameter."""
+    original = dict(params or {})
+    params = dict(original)
+    out = []
+    count = 0
+    i, n = 0, len(cypher)
+
+    def lift(value):
+        nonlocal count
+        name = f"{prefix}{count}"
+        while name in params:  # never shadow a parameter the caller passed
+            count += 1
+            name = f"{prefix}{count}"
+        params[name] = value
+        count += 1
+        out.append("$" + name)
+
+    while i < n:
+        c = cypher[i]
+        if c in "'\"":
+            read = _read_string(cypher, i)
+            if read is None:
+                return cypher, original
+            i, value = read
+            lift(value)
+        elif cypher.startswith("//", i) or cypher.startswith("/*", i):
+            end = cypher.find("\n" if cypher[i + 1] == "/" else "*/", i + 2)
+            end = n if end < 0 else end + (0 if cypher[i + 1] == "/" else 2)
+            out.append(cypher[i:end])
+            i = end
+        elif c == "`":
+            end = cypher.find("`", i + 1)
+            end = n if end < 0 else end + 1
+            out.append(cypher[i:end])
+            i = end
+        elif c == "$" or c.isalpha() or c == "_":
+            # Identifiers, keywords and parameters whole, so the digits in
+            # `title_fr` or `$person0` are never taken for numbers.
+            match = _WORD.match(cypher, i + 1 if c == "$" else i)
+            end = match.end() if match else i + 1
+            out.append(cypher[i:end])
+            i = end
+        elif c == "*":
+            end = _VAR_LENGTH.match(cypher, i).end()
+            out.append(cypher[i:end])
+            i = end
+        elif c == "{" and _QUANTIFIER.match(cypher, i):
+            end = _QUANTIFIER.match(cypher, i).end()
+            out.append(cypher[i:end])
+            i = end
+        elif c.isdigit() or (c == "." and cypher[i + 1:i + 2].isdigit()
+                             and (i == 0 or cypher[i - 1] in _BEFORE_NUMBER)):
+            end = _NUMBER.match(cypher, i).end()
+            literal = cypher[i:end]
+            if _COUNT_CLAUSE.search("".join(out[-16:])):
+                out.append(literal)
+            elif literal[:2].lower() in ("0x", "0o"):
+                lift(int(literal, 0))
+            else:
+                lift(float(literal) if any(ch in literal for ch in ".eE") else int(literal))
+            i = end
+        else:
+            out.append(c)
+            i += 1
+    literals_lifted.inc(amount=len(params) - len(original))
+    return "".join(out), params
+
+
+lookups = Counter("cypher_plan_cache_lookups_total",
+                  "Generated statements run, by whether Neo4j likely had their plan cached",
+                  labels=("result",))
+literals_lifted = Counter("cypher_literals_lifted_total",
+                          "Literals rewritten to parameters in generated Cypher")
+
+
+class PlanCacheEstimate:
+    """The last `size` distinct statement texts, as Neo4j's query cache holds them."""
+
+    def __init__(self, size):
+        self.size = size
+        self.texts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, cypher):
+        """Count one run of `cypher`; True if its plan was likely cached."""
+        with self._lock:
+            hit = cypher in self.texts
+            if hit:
+                self.texts.move_to_end(cypher)
+            else:
+                self.texts[cypher] = None
+                if len(self.texts) > self.size:
+                    self.texts.popitem(last=False)
+        lookups.inc("hit" if hit else "miss")
+        return hit
+
+    def hit_rate(self):
+        hits, misses = lookups.value("hit"), lookups.value("miss")
+        return hits / (hits + misses) if hits + misses else 0.0
+
+
+plan_cache = PlanCacheEstimate(int(os.getenv("CYPHER_QUERY_CACHE_SIZE", "1000")))
+
+Gauge("cypher_plan_cache_hit_ratio",
+      "Share of generated statements whose plan Neo4j likely had cached",
+      plan_cache.hit_rate)
@@ -1,9 +1,22 @@
+import json
+import os
 import re
-from langchain.prompts.prompt import PromptTemplate
+import time
+from typing import List
 
-from app.services.llm import llm
-from app.services.graph import enhanced_graph as graph
-from app.services.tools.entity_mapper import map_entities
+from pydantic import BaseModel, Field
+
+from app.services.llm import LLM_MODEL, get_llm
+from app.services.graph import stream_query
+from app.services.schema import schema_store
+from app.services.tools.cypher_params import parameterize, plan_cache
+from app.services.tools.projection import project_return
+from app.services.tools.cypher_guard import GUARD_RULES, CypherRejected, check_cypher
+from app.services.tools.entity_mapper import correct_entities, map_entities, spot_entities
+from app.services.cypher_cache import cypher_cache
+from app.services.result_cache import result_cache, result_key
+from app.services.timing import record_stage, stage
+from app.services.tools.neo4j_to_json import D3Builder
 
 CYPHER_GENERATION_TEMPLATE = """You are a Cypher expert. Always generate Cypher queries using graph patterns like (a)-[r]->(b).
 Return nodes and relationships that can be visualized as a graph.
@@ -60,45 +73,327 @@ Question:
 
 Cypher Query:"""
 
-CYPHER_GENERATION_PROMPT = PromptTemplate(
-    input_variables=["schema", "question"], template=CYPHER_GENERATION_TEMPLATE
+# "combined" asks for the entities and the Cypher in one structured call, when
+# the gazetteer found nothing and entity extraction would otherwise be an LLM
+# round trip of its own. "separate" keeps the two calls.
+CYPHER_GENERATION_MODE = os.getenv("CYPHER_GENERATION_MODE", "separate")
+
+COMBINED_GENERATION_TEMPLATE = CYPHER_GENERATION_TEMPLATE.replace(
+    "Question:\n{question}\n\nCypher Query:",
+    """ALSO - Entities as parameters:
+List every person name and every movie title the question mentions, spelled as
+in the question. In the Cypher, never write those names out: refer to the i-th
+person of your list as $person<i> and the i-th movie as $movie<i>, counting
+from 0 — for example {{title: $movie0}} or WHERE p.name = $person1. The names
+are corrected against the database and passed in as parameters.
+
+Question:
+{question}""",
 )
 
 
-schema = graph.schema
+# What the LLM is told when the guard turns its statement down.
+CYPHER_RETRY_TEMPLATE = """
+
+Your previous Cypher query was rejected before running, because {reason}:
+{cypher}
+
+Write a corrected Cypher query that answers the same question."""
+
+# Rejections tolerated per question before giving up, and the server-side
+# timeout every generated statement runs under.
+GUARD_RETRIES = int(os.getenv("GUARD_RETRIES", "2"))
+CYPHER_TIMEOUT_SECONDS = float(os.getenv("CYPHER_TIMEOUT_SECONDS", "15"))
+
+
+class CombinedGeneration(BaseModel):
+    persons: List[str] = Field(description="Person names mentioned in the question")
+    movies: List[str] = Field(description="Movie titles mentioned in the question")
+    cypher: str = Field(description="The Cypher query, names as $person<i>/$movie<i>")
+
+
+def _clean_cypher(text):
+    # Remove markdown code fences if present
+    cypher = re.sub(r"^```(?:cypher)?\s*", "", text.strip())
+    cypher = re.sub(r"\s*```$", "", cypher)
+    # Safety: ensure LIMIT exists
+    if not re.search(r"\bLIMIT\b", cypher, re.IGNORECASE):
+        cypher = cypher.rstrip().rstrip(";") + "\nLIMIT 60"
+    return cypher
+
+
+def _prepared(cypher, params):
+    """The statement that actually runs for `cypher`: nodes projected to the
+    fields the graph uses, literals lifted so the plan is shared."""
+    return parameterize(project_return(cypher), params)
+
+
+async def _guarded(cypher, params, regenerate, checked=False):
+    """Check `cypher`; while the guard rejects it, ask for another.
 
+    What is checked is the statement as it will run, rewritten by `_prepared`:
+    its EXPLAIN plans the very text the run then finds in Neo4j's plan cache,
+    and a statement the rewrites broke is turned down like any other.
 
-def cypher_qa_tool(question: str, schema=schema) -> str:
+    `checked` says the first statement is a Cypher-cache hit: it passed these
+    rules when it was stored (they are part of the key), so it is not sent to
+    Neo4j for another EXPLAIN.
+
+    `regenerate(prompt_suffix)` returns `(cypher, params)` for a new attempt.
+    Returns the accepted `(cypher, params, (statement, statement_params),
+    retried)`; raises `CypherRejected` once the retries are spent.
     """
-    Generate Cypher with LLM, run it on Neo4j. No second LLM call.
+    for attempt in range(GUARD_RETRIES + 1):
+        prepared = _prepared(cypher, params)
+        if checked and attempt == 0:
+            return cypher, params, prepared, False
+        reason = await check_cypher(*prepared)
+        if reason is None:
+            return cypher, params, prepared, attempt > 0
+        print(f"Cypher rejected, {reason}:\n{cypher}\n")
+        if attempt == GUARD_RETRIES:
+            raise CypherRejected(reason, cypher)
+        cypher, params = await regenerate(
+            CYPHER_RETRY_TEMPLATE.format(reason=reason, cypher=cypher))
+
+
+async def _generate_cypher(question, schema):
+    """Steps 0 and 1, shared by the buffered and the streaming chat.
+
+    Returns the mapped entities, the Cypher and its parameters, whether it came
+    from the cache, and what to remember under which key once Neo4j has
+    accepted it.
     """
-    # Step 0: Map entities (fix misspellings via full-text index)
+    # Read per request, so a refreshed schema is used as soon as it lands.
+    if schema is None:
+        schema = await schema_store.current()
+    last_user_msg = question[-1]["content"] if isinstance(question, list) else question
+    # /chat sends a list even without history; a single message is a question
+    # on its own, which the combined call can take.
+    standalone = isinstance(question, str) or len(question) == 1
+    if CYPHER_GENERATION_MODE == "combined" and standalone:
+        mapping = spot_entities(last_user_msg)
+        if mapping is None:
+            return await _generate_combined(last_user_msg, schema)
+    else:
+        # Step 0: Map entities (fix misspellings via full-text index)
+        mapping = await map_entities(last_user_msg)
     if isinstance(question, list):
-        last_user_msg = question[-1]["content"]
-        mapping = map_entities(last_user_msg)
         question[-1]["content"] = mapping["corrected"]
     else:
-        mapping = map_entities(question)
         question = mapping["corrected"]
-    entities = mapping["entities"]
 
-    # Step 1: Generate Cypher
-    prompt = CYPHER_GENERATION_PROMPT.format(schema=schema, question=question)
-    response = llm.invoke(prompt)
-    cypher = response.content.strip()
-    # Remove markdown code fences if present
-    cypher = re.sub(r"^```(?:cypher)?\s*", "", cypher)
-    cypher = re.sub(r"\s*```$", "", cypher)
-    # Safety: ensure LIMIT exists
-    if not re.search(r"\bLIMIT\b", cypher, re.IGNORECASE):
-        cypher = cypher.rstrip().rstrip(";") + "\nLIMIT 60"
-    print("Generated Cypher:\n" + cypher + "\n")
+    # Step 1: Generate Cypher, unless this exact question was answered before
+    cache_key = cypher_cache.key(question, schema, CYPHER_GENERATION_TEMPLATE,
+                                 LLM_MODEL, GUARD_RULES)
+    cypher = cypher_cache.get(cache_key)
+    cache_status = "hit" if cypher is not None else "miss"
+    prompt = CYPHER_GENERATION_TEMPLATE.format(schema=schema, question=question)
+
+    async def ask(suffix=""):
+        with stage("generate"):
+            response = await get_llm().ainvoke(prompt + suffix)
+        return _clean_cypher(response.content), {}
 
-    # Step 2: Run on Neo4j directly
-    results = graph.query(cypher)
-    print("Returned " + str(len(results)) + " records")
+    if cypher is None:
+        cypher, _ = await ask()
+    print(f"Generated Cypher (cache {cache_status}):\n" + cypher + "\n")
+    cypher, _, prepared, retried = await _guarded(cypher, {}, ask,
+                                                  checked=cache_status == "hit")
+    if retried:
+        cache_status = "miss"
 
     return {
-        "intermediate_steps": [{"query": cypher}, {"context": results}],
-        "entities": entities
-    }
\ No newline at end of file
+        "entities": mapping["entities"],
+        "corrected": mapping["corrected"],
+        "cypher": cypher,
+        "params": {},
+        "prepared": prepared,
+        "cache_status": cache_status,
+        "cache_key": cache_key,
+        "cache_value": cypher,
+    }
+
+
+async def _generate_combined(question, schema):
+    """Entities and Cypher from one structured LLM call.
+
+    The Cypher names its entities only through $person<i>/$movie<i> slots, so
+    the names can be corrected after the fact and filled in as parameters. The
+    cache keeps the raw names with the template, keyed on the question as
+    typed; a hit still corrects them, which is local or one query.
+    """
+    cache_key = cypher_cache.key(question, schema, COMBINED_GENERATION_TEMPLATE,
+                                 LLM_MODEL, GUARD_RULES)
+    cached = cypher_cache.get(cache_key)
+    cache_status = "hit" if cached is not None else "miss"
+    prompt = COMBINED_GENERATION_TEMPLATE.format(schema=schema, question=question)
+    state = {}
+
+    async def ask(suffix=""):
+        if suffix or cached is None:
+            with stage("generate"):
+                response = await get_llm().with_structured_output(
+                    CombinedGeneration).ainvoke(prompt + suffix)
+            generation = {"persons": response.persons, "movies": response.movies,
+                          "cypher": _clean_cypher(response.cypher)}
+        else:
+            generation = json.loads(cached)
+        mapping = await correct_entities(question, generation)
+        params = {f"person{i}": name
+                  for i, name in enumerate(mapping["entities"]["persons"])}
+        params.update({f"movie{i}": title
+                       for i, title in enumerate(mapping["entities"]["movies"])})
+        state.update(generation=generation, mapping=mapping)
+        return generation["cypher"], params
+
+    cypher, params = await ask()
+    print(f"Generated Cypher (combined, cache {cache_status}):\n" + cypher
+          + f"\nParameters: {params}\n")
+    cypher, params, prepared, retried = await _guarded(cypher, params, ask,
+                                                       checked=cached is not None)
+    if retried:
+        cache_status = "miss"
+    mapping = state["mapping"]
+    if cache_status == "miss":
+        cached = json.dumps(state["generation"], ensure_ascii=False)
+
+    return {
+        "entities": mapping["entities"],
+        "corrected": mapping["corrected"],
+        "cypher": cypher,
+        "params": params,
+        "prepared": prepared,
+        "cache_status": cache_status,
+        "cache_key": cache_key,
+        "cache_value": cached,
+    }
+
+
+def _remember(generated):
+    # Only remembered once Neo4j has accepted it: a statement that fails to
+    # compile would otherwise be served back, failing, for as long as it lives.
+    if generated["cache_status"] == "miss":
+        cypher_cache.set(generated["cache_key"], generated["cache_value"])
+
+
+async def cypher_qa_tool(question: str, schema=None) -> str:
+    """
+    Generate Cypher with LLM, run it on Neo4j. No second LLM call.
+
+    A coroutine all the way down — LLM calls and Neo4j round trips alike — so
+    the event loop keeps serving other requests while this one waits.
+    """
+    generated = await _generate_cypher(question, schema)
+    cypher = generated["cypher"]
+
+    # Step 2: Run on Neo4j directly the statement the guard passed (literals
+    # lifted, nodes projected), and fold the records into the graph as they
+    # come off the cursor.
+    statement, params = generated["prepared"]
+    key = await result_key("d3", statement, params)
+    cached = result_cache.get(key)
+    result_hit = cached is not None
+    if not result_hit:
+        plan_cache.observe(statement)
+        builder = D3Builder()
+        async with stream_query(statement, params, fetch_size=RECORD_FETCH_SIZE,
+                                timeout=CYPHER_TIMEOUT_SECONDS, source="cypher_to_d3",
+                                raw=True) as records:
+            # Fetching and converting interleave past the first response; the
+            # conversion is summed apart so each still shows as its own stage.
+            started = time.perf_counter()
+            folding = 0.0
+            async for record in records:
+                fold_started = time.perf_counter()
+                builder.add(record)
+                folding += time.perf_counter() - fold_started
+        record_stage("neo4j", time.perf_counter() - started - folding)
+        record_stage("d3", folding)
+        cached = (builder.result(), builder.records)
+        result_cache.set(key, cached)
+    d3_data, records = cached
+    print("Returned " + str(records) + " records"
+          + (" (result cache hit)" if result_hit else ""))
+    _remember(generated)
+
+    return {
+        "intermediate_steps": [{"query": cypher, "params": generated["params"]},
+                               {"records": records}],
+        "d3": d3_data,
+        "entities": generated["entities"],
+        "cache": {"cypher": generated["cache_status"],
+                  "result": "hit" if result_hit else "miss"},
+    }
+
+
+# Rows per nodes/links event when streaming. Small enough that the first batch
+# leaves early, large enough that a 60-row result is a couple of events.
+STREAM_BATCH_ROWS = 20
+
+# Rows per fetch when the whole result is wanted anyway: one round trip for
+# anything the prompt's LIMIT allows.
+RECORD_FETCH_SIZE = 1000
+
+
+async def cypher_qa_stream(question, schema=None):
+    """`cypher_qa_tool` as a sequence of events, sent as each phase finishes.
+
+    In order: `entities` once they are resolved, `cypher` once it is known,
+    then `nodes` and `links` batches as rows come off the Neo4j cursor — a
+    batch's nodes always before the links that refer to them — and finally
+    `summary`. That last one carries the complete payload under `d3` for the
+    caller to keep; it is not meant for the wire as is.
+    """
+    generated = await _generate_cypher(question, schema)
+    yield {"event": "entities", "entities": generated["entities"],
+           "corrected": generated["corrected"]}
+    cypher = generated["cypher"]
+    params = generated["params"]
+    yield {"event": "cypher", "cypher": cypher, "params": params,
+           "cache": generated["cache_status"]}
+
+    statement, statement_params = generated["prepared"]
+    # Shared with `cypher_qa_tool`: the finished graph and its record count.
+    key = await result_key("d3", statement, statement_params)
+    cached = result_cache.get(key)
+
+    def events(nodes, links):
+        if nodes:
+            yield {"event": "nodes", "nodes": nodes}
+        if links:
+            yield {"event": "links", "links": links}
+
+    if cached is not None:
+        # Already whole: no rows to pace it by, so nodes first, then links.
+        d3_data, records = cached
+        for event in events(d3_data["nodes"], d3_data["links"]):
+            yield event
+    else:
+        plan_cache.observe(statement)
+        builder = D3Builder()
+        async with stream_query(statement, statement_params,
+                                fetch_size=STREAM_BATCH_ROWS,
+                                timeout=CYPHER_TIMEOUT_SECONDS,
+                                source="cypher_to_d3", raw=True) as cursor:
+            new_nodes, new_links = [], []
+            async for record in cursor:
+                added_nodes, added_links = builder.add(record)
+                new_nodes += added_nodes
+                new_links += added_links
+                if builder.records % STREAM_BATCH_ROWS == 0:
+                    for event in events(new_nodes, new_links):
+                        yield event
+                    new_nodes, new_links = [], []
+            for event in events(new_nodes, new_links):
+                yield event
+        d3_data, records = builder.result(), builder.records
+        result_cache.set(key, (d3_data, records))
+    _remember(generated)
+    print("Returned " + str(records) + " records (streamed"
+          + (", result cache hit)" if cached is not None else ")"))
+
+    yield {"event": "summary", "d3": d3_data,
+           "records": records,
+           "cache": {"cypher": generated["cache_status"],
+                     "result": "hit" if cached is not None else "miss"}}
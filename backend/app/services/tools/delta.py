@@ -0,0 +1,110 @@
+"""Drill-down responses as a delta against the graph the client already has.
+
+Each expansion on a deep exploration trail overlaps the graph on screen — the
+node double-clicked, its films, the co-stars already met — and every one of
+those nodes used to be sent again in full. A client may say what it holds:
+
+    ?known=nm0000033,tt0052357,...          the ids themselves
+    ?known_bloom=<base64url>&bloom_k=7      a Bloom filter of them
+
+and gets back only the nodes it lacks, every link, and under `known` a
+reference for each node it was spared — `{"id": ...}`, plus `subjectRoles` /
+`isCenter` when this view gives the node those, since they depend on which
+node was expanded rather than on the node.
+
+The Bloom filter is for graphs whose id list would not fit in a URL: about
+1.2 bytes per id at a 1% false-positive rate. Its bits are LSB first within
+each byte (bit j is `bytes[j >> 3] >> (j & 7) & 1`), m is 8 x the byte length,
+and an id sets bits `(h1 + i * h2) mod m` for i in 0..k-1, where, over the id's
+UTF-8 bytes, h1 is 32-bit FNV-1a and h2 is 32-bit FNV-1a of the bytes followed
+by "#", with its lowest bit forced to 1. A false positive means a node the
+client does not have arrives as a reference: a client that finds a `known` id
+it cannot resolve asks again with plain `known` ids.
+"""
+
+import base64
+import binascii
+
+# Fields that say how a node relates to the node expanded, not what it is.
+VIEW_FIELDS = ("subjectRoles", "isCenter")
+
+MAX_BLOOM_HASHES = 32
+
+_FNV_OFFSET = 0x811C9DC5
+_FNV_PRIME = 0x01000193
+
+
+def _fnv1a(data):
+    h = _FNV_OFFSET
+    for byte in data:
+        h = ((h ^ byte) * _FNV_PRIME) & 0xFFFFFFFF
+    return h
+
+
+class BloomFilter:
+    def __init__(self, bits, k):
+        self.bits = bits
+        self.m = len(bits) * 8
+        self.k = k
+
+    @classmethod
+    def decode(cls, text, k):
+        """From the query parameter; ValueError when it is not a filter."""
+        try:
+            bits = base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+        except (binascii.Error, ValueError):
+            raise ValueError("known_bloom is not base64url") from None
+        if not bits:
+            raise ValueError("known_bloom is empty")
+        if not 1 <= k <= MAX_BLOOM_HASHES:
+            raise ValueError(f"bloom_k must be between 1 and {MAX_BLOOM_HASHES}")
+        return cls(bits, k)
+
+    @classmethod
+    def of(cls, ids, size, k):
+        """A filter of `size` bytes holding `ids`; what a client builds."""
+        bloom = cls(bytearray(size), k)
+        for node_id in ids:
+            for j in bloom._positions(node_id):
+                bloom.bits[j >> 3] |= 1 << (j & 7)
+        return bloom
+
+    def encode(self):
+        return base64.urlsafe_b64encode(bytes(self.bits)).decode().rstrip("=")
+
+    def _positions(self, node_id):
+        data = node_id.encode()
+        h1 = _fnv1a(data)
+        h2 = _fnv1a(data + b"#") | 1
+        return ((h1 + i * h2) % self.m for i in range(self.k))
+
+    def __contains__(self, node_id):
+        return all(self.bits[j >> 3] >> (j & 7) & 1 for j in self._positions(node_id))
+
+
+def known_set(known=None, bloom=None, k=None):
+    """What the client holds, as something `in` works on; None for nothing.
+
+    Raises ValueError on a malformed filter.
+    """
+    if bloom:
+        return BloomFilter.decode(bloom, k or 0)
+    ids = {node_id for node_id in (known or "").split(",") if node_id}
+    return ids or None
+
+
+def delta(d3_data, known):
+    """`d3_data` minus the nodes in `known`, each replaced by a reference.
+
+    A new dict; the payload passed in is cached and shared, and is not touched.
+    """
+    nodes = []
+    references = []
+    for node in d3_data["nodes"]:
+        if node["id"] in known:
+            reference = {"id": node["id"]}
+            reference.update((f, node[f]) for f in VIEW_FIELDS if f in node)
+            references.append(reference)
+        else:
+            nodes.append(node)
+    return {**d3_data, "nodes": nodes, "known": references}
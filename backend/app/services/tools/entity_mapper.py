@@ -1,7 +1,11 @@
+import asyncio
 import json
 from typing import Optional
-from app.services.llm import llm
-from app.services.graph import enhanced_graph as graph
+from app.services.llm import get_llm
+from app.services.graph import run_query
+from app.services.timing import stage
+from app.services.tools.gazetteer import gazetteer, unmatched
+from app.services.tools.name_index import name_index
 
 EXTRACT_ENTITIES_PROMPT = """Extract person names and movie titles from the following question.
 Return ONLY a JSON object with two keys: "persons" (list of person names) and "movies" (list of movie titles).
@@ -12,9 +16,10 @@ Question: {question}
 JSON:"""
 
 
-def _extract_entities(question: str) -> dict:
+async def _extract_entities(question: str) -> dict:
     """Use the LLM to extract person names and movie titles from the question."""
-    response = llm.invoke(EXTRACT_ENTITIES_PROMPT.format(question=question))
+    with stage("extract"):
+        response = await get_llm().ainvoke(EXTRACT_ENTITIES_PROMPT.format(question=question))
     text = response.content.strip()
     # Remove markdown code fences if present
     if text.startswith("```"):
@@ -26,42 +31,131 @@ def _extract_entities(question: str) -> dict:
         return {"persons": [], "movies": []}
 
 
-def _fuzzy_match(name: str, index_name: str, property_name: str) -> Optional[str]:
-    """Query a Neo4j full-text index. Tries exact match first, then fuzzy."""
-    # 1) Try exact match (quoted phrase)
-    results = graph.query(
-        f"CALL db.index.fulltext.queryNodes('{index_name}', $query) "
-        "YIELD node, score "
-        f"RETURN node.{property_name} AS match, score LIMIT 1",
-        {"query": f'"{name}"'}
-    )
-    if results:
-        return results[0]["match"]
-
-    # 2) Fallback: fuzzy match per token (each word gets ~)
-    fuzzy_query = " ".join(word + "~" for word in name.split())
-    results = graph.query(
-        f"CALL db.index.fulltext.queryNodes('{index_name}', $query) "
-        "YIELD node, score "
-        f"RETURN node.{property_name} AS match, score LIMIT 1",
-        {"query": fuzzy_query}
-    )
-    if results and results[0]["score"] > 3.0:
-        return results[0]["match"]
+# Every name of one kind in a single round trip. Per name, the best exact
+# (quoted phrase) hit and the best fuzzy (each word gets ~) hit come back side
+# by side, and `_pick_match` chooses between them here — exact first, as the
+# two sequential queries this replaces did.
+FULLTEXT_MATCH_CYPHER = """
+UNWIND range(0, size($queries) - 1) AS i
+CALL {{
+    WITH i
+    CALL db.index.fulltext.queryNodes('{index_name}', $queries[i].exact)
+    YIELD node, score
+    RETURN node.{property_name} AS match, score, true AS exact
+    LIMIT 1
+    UNION
+    WITH i
+    CALL db.index.fulltext.queryNodes('{index_name}', $queries[i].fuzzy)
+    YIELD node, score
+    RETURN node.{property_name} AS match, score, false AS exact
+    LIMIT 1
+}}
+RETURN i, match, score, exact
+"""
+
+FUZZY_MIN_SCORE = 3.0
+
+
+def _pick_match(candidates: list) -> Optional[str]:
+    """Exact hit if there is one, else a fuzzy hit that scores well enough."""
+    for candidate in candidates:
+        if candidate["exact"]:
+            return candidate["match"]
+    for candidate in candidates:
+        if candidate["score"] > FUZZY_MIN_SCORE:
+            return candidate["match"]
     return None
 
 
-def map_entities(question: str) -> dict:
+async def _fuzzy_match_all(names: list, index_name: str, property_name: str,
+                           kind: str) -> list:
+    """Correct every name: from memory where possible, else with one query
+    against a Neo4j full-text index for all the rest.
+    Returns the matched value per name, None where nothing matched."""
+    matches = [name_index.correct(name, kind) for name in names]
+    missing = [i for i, match in enumerate(matches) if match is None]
+    if missing:
+        remote = await _fulltext_match_all([names[i] for i in missing],
+                                           index_name, property_name)
+        for i, match in zip(missing, remote):
+            matches[i] = match
+    return matches
+
+
+async def _fulltext_match_all(names: list, index_name: str, property_name: str) -> list:
+    """Query a Neo4j full-text index for every name at once."""
+    if not names:
+        return []
+    queries = [{"exact": f'"{name}"',
+                "fuzzy": " ".join(word + "~" for word in name.split())}
+               for name in names]
+    results = await run_query(
+        FULLTEXT_MATCH_CYPHER.format(index_name=index_name, property_name=property_name),
+        {"queries": queries},
+        source="entity_mapper",
+    )
+    candidates = [[] for _ in names]
+    for row in results:
+        candidates[row["i"]].append(row)
+    return [_pick_match(c) for c in candidates]
+
+
+def spot_entities(question: str) -> Optional[dict]:
+    """Find entities with the local gazetteer; None when it finds nothing, or
+    leaves a capitalised word unaccounted for (a misspelt name, most likely).
+
+    Hits are canonical node labels already, so they need no fuzzy matching:
+    the corrected question is the question with each hit spelled as stored.
+    """
+    current = gazetteer.current()
+    hits = current.find(question) if current is not None else []
+    if not hits:
+        return None
+    leftover = unmatched(question, hits)
+    if leftover:
+        print(f"Gazetteer: {leftover} unrecognised, asking the LLM")
+        return None
+    corrected = question
+    entities = {"persons": [], "movies": []}
+    # Right to left, so the offsets of the hits still ahead stay valid.
+    for start, end, kind, label in reversed(hits):
+        if corrected[start:end] != label:
+            print(f"Entity mapped: '{corrected[start:end]}' -> '{label}'")
+            corrected = corrected[:start] + label + corrected[end:]
+        entities[kind + "s"].insert(0, label)
+    return {"corrected": corrected, "entities": entities}
+
+
+async def map_entities(question: str) -> dict:
     """Extract entities from the question, fuzzy-match them against Neo4j.
     Returns {"corrected": str, "entities": {"persons": [...], "movies": [...]}}
     where entities lists contain the matched (corrected) names."""
-    entities = _extract_entities(question)
+    spotted = spot_entities(question)
+    if spotted is not None:
+        if spotted["corrected"] != question:
+            print(f"Corrected question: {spotted['corrected']}")
+        return spotted
+
+    # Nothing the gazetteer knows: ask the LLM, then correct what it found.
+    return await correct_entities(question, await _extract_entities(question))
+
+
+async def correct_entities(question: str, entities: dict) -> dict:
+    """Fuzzy-match extracted names against the graph, spelling fixed in the
+    question too. Same return shape as `map_entities`; a name nothing matched
+    is kept as extracted."""
+    persons = entities.get("persons", [])
+    movies = entities.get("movies", [])
+    with stage("match"):
+        person_matches, movie_matches = await asyncio.gather(
+            _fuzzy_match_all(persons, "personNameIndex", "name", "person"),
+            _fuzzy_match_all(movies, "movieTitleIndex", "title", "movie"),
+        )
     corrected = question
     matched_persons = []
     matched_movies = []
 
-    for person in entities.get("persons", []):
-        match = _fuzzy_match(person, "personNameIndex", "name")
+    for person, match in zip(persons, person_matches):
         if match:
             matched_persons.append(match)
             if match.lower() != person.lower():
@@ -70,8 +164,7 @@ def map_entities(question: str) -> dict:
         else:
             matched_persons.append(person)
 
-    for movie in entities.get("movies", []):
-        match = _fuzzy_match(movie, "movieTitleIndex", "title")
+    for movie, match in zip(movies, movie_matches):
         if match:
             matched_movies.append(match)
             if match.lower() != movie.lower():
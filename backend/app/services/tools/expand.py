@@ -6,14 +6,25 @@ for a Person, their movies plus the main actors and the directors of those
 movies; for a Movie, everyone involved in it.
 """
 
-from app.services.graph import enhanced_graph as graph
+import asyncio
+
+from app.services.graph import run_query, stream_query
+from app.services.tools.projection import MOVIE_FIELDS, PERSON_FIELDS, map_projection
 from app.services.tools.titles import localised_titles
 
+
+def _projected(cypher):
+    """Fill in the `{PERSON}`/`{MOVIE}` map projections: only the fields
+    `_person_node`/`_movie_node` read travel, not the embeddings."""
+    return (cypher.replace("{PERSON}", map_projection(PERSON_FIELDS))
+            .replace("{MOVIE}", map_projection(MOVIE_FIELDS)))
+
+
 # Step 1 of the person expansion: the person and their complete filmography,
 # most central first. Movies own the node budget, so this is capped only by the
 # budget itself, not by a small fixed limit. The CALL aggregates, so a person
 # with no films still comes back as a row.
-EXPAND_PERSON_CYPHER = """
+EXPAND_PERSON_CYPHER = _projected("""
 MATCH (p:Person)
 WHERE p.personId = $person OR p.name = $person
 WITH p LIMIT 1
@@ -24,40 +35,53 @@ CALL {
     ORDER BY coalesce(m.pageRank, 0) DESC,
              coalesce(m.degreeCentrality, 0) DESC
     LIMIT $movieLimit
-    RETURN collect({movie: m, roles: roles}) AS movies
+    RETURN collect({movie: m {MOVIE}, roles: roles}) AS movies
 }
-RETURN p AS person, movies
-"""
+RETURN p {PERSON} AS person, movies
+""")
 
 # Step 2: the crew of those movies. Every director (there are few, and a
 # co-director is more informative than one more actor) plus the top actors of
 # each. `actorLimit` is the per-movie allowance the caller computed from what is
 # left of the node budget; the caller then decides who actually fits.
-EXPAND_PERSON_CREW_CYPHER = """
-MATCH (m:Movie)
-WHERE m.movieId IN $movieIds
+#
+# One row per credit, in exactly the order the caller spends the budget:
+# directors first (rank -1), then actors round-robin — every film's top actor,
+# then every film's second, and so on, films in filmography order. That lets
+# the caller stop reading the moment the graph is full; the rest of the rows
+# are discarded on the server rather than shipped and thrown away.
+EXPAND_PERSON_CREW_CYPHER = _projected("""
+UNWIND range(0, size($movieIds) - 1) AS movieIndex
+MATCH (m:Movie {movieId: $movieIds[movieIndex]})
 CALL {
     WITH m
     MATCH (d:Person)-[:DIRECTED]->(m)
-    RETURN collect(DISTINCT d) AS directors
-}
-CALL {
+    WITH DISTINCT d
+    RETURN d {PERSON} AS person, 'DIRECTED' AS label, -1 AS rank
+    UNION ALL
     WITH m
     MATCH (a:Person)-[:ACTED_IN]->(m)
-    WITH a
+    WITH DISTINCT a
     ORDER BY coalesce(a.pageRank, 0) DESC,
              coalesce(a.degreeCentrality, 0) DESC
     LIMIT $actorLimit
-    RETURN collect(a) AS actors
+    WITH collect(a {PERSON}) AS actors
+    UNWIND range(0, size(actors) - 1) AS rank
+    RETURN actors[rank] AS person, 'ACTED_IN' AS label, rank
 }
-RETURN m.movieId AS movieId, directors, actors
-"""
+RETURN m.movieId AS movieId, person, label, rank
+ORDER BY rank, movieIndex
+""")
+
+# Rows pulled per round trip while streaming the crew. Stopping early wastes at
+# most one batch.
+CREW_FETCH_SIZE = 200
 
 
 # Movie -> every person attached to it, whatever the relationship type
 # (ACTED_IN, DIRECTED, ...). The people are collected inside the CALL so the
 # movie still comes back as a single row even when nobody is linked to it.
-EXPAND_MOVIE_CYPHER = """
+EXPAND_MOVIE_CYPHER = _projected("""
 MATCH (m:Movie)
 WHERE m.movieId = $movie OR m.title = $movie
 WITH m LIMIT 1
@@ -68,11 +92,59 @@ CALL {
     ORDER BY coalesce(p.pageRank, 0) DESC,
              coalesce(p.degreeCentrality, 0) DESC
     LIMIT $personLimit
-    RETURN collect({person: p, roles: roles}) AS people
+    RETURN collect({person: p {PERSON}, roles: roles}) AS people
 }
-RETURN m AS movie, people
-"""
+RETURN m {MOVIE} AS movie, people
+""")
+
+
+# Batch drill-down (POST /expand/batch): many seeds of one type in a single
+# UNWIND, one row per seed. LIMIT cannot take a per-row value, so each seed's
+# neighbours are ranked, collected and sliced to its own `limit` instead; the
+# slice still keeps the surplus on the server.
+#
+# A Person seed brings its filmography only, not the crew of those films —
+# that second hop is what /expand/person spends its budget on, and it would
+# need a second query per person.
+EXPAND_PERSONS_BATCH_CYPHER = _projected("""
+UNWIND $seeds AS seed
+CALL {
+    WITH seed
+    MATCH (p:Person)
+    WHERE p.personId = seed.id OR p.name = seed.id
+    WITH p LIMIT 1
+    CALL {
+        WITH p
+        MATCH (p)-[r:ACTED_IN|DIRECTED]->(m:Movie)
+        WITH m, collect(DISTINCT type(r)) AS roles
+        ORDER BY coalesce(m.pageRank, 0) DESC,
+                 coalesce(m.degreeCentrality, 0) DESC
+        RETURN collect({movie: m {MOVIE}, roles: roles}) AS movies
+    }
+    RETURN p, movies
+}
+RETURN seed.id AS seed, p {PERSON} AS person, movies[..seed.limit] AS movies
+""")
 
+EXPAND_MOVIES_BATCH_CYPHER = _projected("""
+UNWIND $seeds AS seed
+CALL {
+    WITH seed
+    MATCH (m:Movie)
+    WHERE m.movieId = seed.id OR m.title = seed.id
+    WITH m LIMIT 1
+    CALL {
+        WITH m
+        MATCH (p:Person)-[r]->(m)
+        WITH p, collect(DISTINCT type(r)) AS roles
+        ORDER BY coalesce(p.pageRank, 0) DESC,
+                 coalesce(p.degreeCentrality, 0) DESC
+        RETURN collect({person: p {PERSON}, roles: roles}) AS people
+    }
+    RETURN m, people
+}
+RETURN seed.id AS seed, m {MOVIE} AS movie, people[..seed.limit] AS people
+""")
 
 def _person_node(props, is_center=False):
     node = {
@@ -108,7 +180,7 @@ def _movie_node(props, is_center=False, roles=None):
     return node
 
 
-def expand_person(person: str, node_limit: int = 200) -> dict:
+async def expand_person(person: str, node_limit: int = 200) -> dict:
     """Return a D3 payload centred on `person` (personId or exact name).
 
     The whole filmography comes first: every movie the person acted in or
@@ -125,9 +197,10 @@ def expand_person(person: str, node_limit: int = 200) -> dict:
     still travels in `entities` and `center` so the UI can title the view.
     """
     movie_cap = max(1, node_limit)
-    records = graph.query(
+    records = await run_query(
         EXPAND_PERSON_CYPHER,
         {"person": person, "movieLimit": movie_cap},
+        source="expand",
     )
     if not records:
         return {"nodes": [], "links": [], "center": None,
@@ -180,33 +253,27 @@ def expand_person(person: str, node_limit: int = 200) -> dict:
         # filmography, and a duplicate costs no budget, so the surplus is what
         # keeps the graph filling up to the limit rather than stalling short.
         per_movie = max(1, remaining // len(movie_ids) + 2)
-        crew_records = graph.query(
+        async with stream_query(
             EXPAND_PERSON_CREW_CYPHER,
             {"movieIds": movie_ids, "actorLimit": per_movie},
-        )
-        crew = {r["movieId"]: r for r in crew_records}
-
-        # Directors of every movie first.
-        for movie_id in movie_ids:
-            for director_props in crew.get(movie_id, {}).get("directors", []):
-                if director_props["personId"] == center_id:
+            fetch_size=CREW_FETCH_SIZE,
+            source="expand",
+        ) as crew:
+            # Directors of every movie come first, then actors round-robin:
+            # one per movie per pass, so the budget is shared across the
+            # filmography instead of being drained by movie #1. The budget is
+            # checked between passes; within one, people already on the graph
+            # still link for free.
+            current_rank = None
+            async for row in crew:
+                if row["rank"] != current_rank:
+                    current_rank = row["rank"]
+                    if current_rank >= 0 and len(nodes) >= node_limit:
+                        break
+                person_props = row["person"]
+                if person_props["personId"] == center_id:
                     continue
-                add_related(director_props, movie_id, "DIRECTED")
-
-        # Then actors round-robin: one per movie per pass, so the budget is
-        # shared across the filmography instead of being drained by movie #1.
-        depth = max((len(r["actors"]) for r in crew_records), default=0)
-        for rank in range(depth):
-            if len(nodes) >= node_limit:
-                break
-            for movie_id in movie_ids:
-                actors = crew.get(movie_id, {}).get("actors", [])
-                if rank >= len(actors):
-                    continue
-                actor_props = actors[rank]
-                if actor_props["personId"] == center_id:
-                    continue
-                add_related(actor_props, movie_id, "ACTED_IN")
+                add_related(person_props, row["movieId"], row["label"])
 
     return {
         "nodes": list(nodes.values()),
@@ -216,15 +283,16 @@ def expand_person(person: str, node_limit: int = 200) -> dict:
     }
 
 
-def expand_movie(movie: str, person_limit: int = 200) -> dict:
+async def expand_movie(movie: str, person_limit: int = 200) -> dict:
     """Return a D3 payload centred on `movie` (movieId or exact title).
 
     Nodes: the movie plus every person linked to it — actors, directors and any
     other relationship type — capped at `person_limit`, most central first.
     """
-    records = graph.query(
+    records = await run_query(
         EXPAND_MOVIE_CYPHER,
         {"movie": movie, "personLimit": person_limit},
+        source="expand",
     )
 
     nodes = []
@@ -255,3 +323,73 @@ def expand_movie(movie: str, person_limit: int = 200) -> dict:
         "center": nodes[0]["id"] if nodes else None,
         "entities": {"persons": [], "movies": [nodes[0]["label"]] if nodes else []},
     }
+
+
+async def expand_batch(persons=(), movies=()) -> dict:
+    """Expand many seeds at once into one merged D3 payload.
+
+    `persons` and `movies` are lists of `(id, limit)`: a personId or exact name
+    with how many films to bring, a movieId or exact title with how many people.
+    One query per node type, both in flight together, instead of one round trip
+    per seed — the difference between prefetching a filmography's casts in two
+    round trips and in fifty.
+
+    Nodes and links are deduplicated across seeds. `members` maps every seed,
+    as the caller spelled it, to the ids of the nodes it contributed (itself
+    included), so the client can still tell whose neighbourhood is whose; a seed
+    that resolved to nothing maps to an empty list. Unlike /expand/person, a
+    Person seed is on the graph: the caller asked about several at once, and
+    the links are what say which films belong to whom.
+    """
+    queries = []
+    if persons:
+        queries.append(run_query(
+            EXPAND_PERSONS_BATCH_CYPHER,
+            {"seeds": [{"id": i, "limit": n} for i, n in persons]},
+            source="expand",
+        ))
+    if movies:
+        queries.append(run_query(
+            EXPAND_MOVIES_BATCH_CYPHER,
+            {"seeds": [{"id": i, "limit": n} for i, n in movies]},
+            source="expand",
+        ))
+    results = await asyncio.gather(*queries)
+
+    nodes = {}
+    links = {}
+    # dicts as ordered sets: a node reached twice from one seed is listed once.
+    members = {seed: {} for seed, _ in list(persons) + list(movies)}
+
+    def add(seed, node):
+        nodes.setdefault(node["id"], node)
+        members[seed][node["id"]] = None
+
+    def link(source, target, roles):
+        for role in roles:
+            links[(source, target, role)] = {
+                "source": source,
+                "target": target,
+                "label": role,
+            }
+
+    for record in (r for rows in results for r in rows):
+        seed = record["seed"]
+        if record.get("person") is not None:
+            person_id = record["person"]["personId"]
+            add(seed, _person_node(record["person"]))
+            for entry in record["movies"]:
+                add(seed, _movie_node(entry["movie"]))
+                link(person_id, entry["movie"]["movieId"], entry["roles"])
+        elif record.get("movie") is not None:
+            movie_id = record["movie"]["movieId"]
+            add(seed, _movie_node(record["movie"]))
+            for entry in record["people"]:
+                add(seed, _person_node(entry["person"]))
+                link(entry["person"]["personId"], movie_id, entry["roles"])
+
+    return {
+        "nodes": list(nodes.values()),
+        "links": list(links.values()),
+        "members": {seed: list(ids) for seed, ids in members.items()},
+    }
@@ -0,0 +1,207 @@
+"""Local person/movie name spotting, in place of the LLM extraction call.
+
+`entity_mapper` used to spend a full LLM round trip on every chat message only
+to learn which words were a name or a title. For the names people actually ask
+about that is a dictionary lookup: every node that can reach a graph carries a
+`pageRank` and is already in the node store, label included.
+
+The gazetteer is a token trie over the normalised labels of the best-ranked
+nodes of each kind (`GAZETTEER_SIZE` apiece). A question is scanned once per
+token position, keeping the longest entry that starts there, so "Alfred
+Hitchcock" wins over a film called "Alfred". Where the same words name several
+nodes — remakes, namesakes — the one with the higher pageRank is the entry.
+
+Matching is deliberately conservative, because a false hit skips the LLM that
+would have got it right:
+
+- an entry made only of stopwords ("The End") is never matched;
+- a single-word entry must be capitalised in the question and not a stopword,
+  so "her" and "up" stay words while "Psycho" is a film. The capital that
+  starts a sentence does not count: "Tell me about..." is not the film "Tell";
+- an all-lowercase hit must be a person or at least three words long, which
+  keeps "best friends" a phrase and "alfred hitchcock" a director.
+
+Nothing matched means the caller falls back to the LLM, and so does a question
+with a capitalised word no hit covers (`unmatched`): "Alfred Hitchcok" finds
+the film "Alfred", but "Hitchcok" says a name went unrecognised, and only the
+LLM and the full-text correction after it can recover it.
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from app.services.node_store import TABLES, node_store
+from app.services.startup import startup_profile
+
+GAZETTEER_SIZE = int(os.getenv("GAZETTEER_SIZE", "50000"))
+
+_TOKEN = re.compile(r"\w+")
+# What ends a sentence, so that the word after it is capitalised regardless.
+_SENTENCE_END = ".!?:"
+
+STOPWORDS = frozenset("""
+a about all an and any are as at be between both by can did do does film films
+for from give has have how i in is it list many me movie movies my not of on
+one or show star starred starring than that the their them these they this
+those to together was were what when where which who whom with would you your
+""".split())
+
+
+def _fold(token):
+    """Case and accents away: 'Amélie' and 'amelie' are the same token."""
+    decomposed = unicodedata.normalize("NFKD", token.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _tokens(text):
+    return [_fold(m.group()) for m in _TOKEN.finditer(text)]
+
+
+def _sentence_initial(text, start):
+    before = text[:start].rstrip()
+    return not before or before[-1] in _SENTENCE_END
+
+
+def _capitalised(text, match):
+    """Whether the word `match` is capitalised by choice, not by position."""
+    return match.group()[:1].isupper() and not _sentence_initial(text, match.start())
+
+
+def unmatched(text, hits):
+    """The capitalised words of `text` outside every hit, stopwords aside."""
+    return [m.group() for m in _TOKEN.finditer(text)
+            if _capitalised(text, m) and _fold(m.group()) not in STOPWORDS
+            and not any(start <= m.start() < end for start, end, _, _ in hits)]
+
+
+class Gazetteer:
+    """Token trie over canonical names: (state, token) -> state, flat."""
+
+    def __init__(self, generation=None):
+        self.generation = generation
+        self.edges = {}
+        # state -> (kind, canonical label, pageRank)
+        self.entries = {}
+        self._states = 1  # 0 is the root
+
+    def add(self, kind, label, weight):
+        tokens = _tokens(label)
+        if not tokens or all(t in STOPWORDS for t in tokens):
+            return
+        state = 0
+        for token in tokens:
+            edge = (state, sys.intern(token))
+            nxt = self.edges.get(edge)
+            if nxt is None:
+                nxt = self.edges[edge] = self._states
+                self._states += 1
+            state = nxt
+        current = self.entries.get(state)
+        if current is None or weight > current[2]:
+            self.entries[state] = (kind, label, weight)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _acceptable(self, text, words, entry):
+        kind, _, _ = entry
+        if len(words) == 1:
+            return _capitalised(text, words[0]) and _fold(words[0].group()) not in STOPWORDS
+        capitalised = any(w.group()[:1].isupper() for w in words)
+        return capitalised or kind == "person" or len(words) >= 3
+
+    def find(self, text):
+        """Non-overlapping hits in `text`, leftmost-longest.
+
+        Returns `(start, end, kind, label)` per hit, offsets into `text`, kind
+        "person" or "movie".
+        """
+        matches = list(_TOKEN.finditer(text))
+        folded = [_fold(m.group()) for m in matches]
+        hits = []
+        i = 0
+        while i < len(matches):
+            state, best = 0, None
+            for j in range(i, len(matches)):
+                state = self.edges.get((state, folded[j]))
+                if state is None:
+                    break
+                entry = self.entries.get(state)
+                if entry is not None and self._acceptable(text, matches[i:j + 1], entry):
+                    best = (j, entry)
+            if best is None:
+                i += 1
+                continue
+            j, (kind, label, _) = best
+            hits.append((matches[i].start(), matches[j].end(), kind, label))
+            i = j + 1
+        return hits
+
+    @classmethod
+    def build(cls, store, size=GAZETTEER_SIZE):
+        """From the node store's tables: the `size` best-ranked nodes of each kind."""
+        gazetteer = cls(store.generation)
+        for prefix, table in store.tables.items():
+            kind = TABLES[prefix][0].lower()
+            ranks = np.nan_to_num(np.asarray(table.centralities["pageRank"]), nan=0.0)
+            if len(ranks) > size:
+                top = np.argpartition(ranks, len(ranks) - size)[-size:]
+            else:
+                top = np.arange(len(ranks))
+            labels = table.strings["label"]
+            for i in top:
+                label = labels[i]
+                if label:
+                    gazetteer.add(kind, label, float(ranks[i]))
+        return gazetteer
+
+
+class GazetteerHolder:
+    """The current gazetteer, rebuilt in the background when the store moves on."""
+
+    def __init__(self, store):
+        self.store = store
+        self.gazetteer = None
+        self._building = False
+        self._failed = None  # generation whose build failed; not retried
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The gazetteer to match with now, or None while there is none yet.
+
+        Never blocks on a build: a stale gazetteer keeps answering until the
+        fresh one replaces it, and with none at all the LLM does the extracting.
+        """
+        store, gazetteer = self.store, self.gazetteer
+        generation = store.generation
+        if (store.ready and generation != self._failed
+                and (gazetteer is None or gazetteer.generation != generation)):
+            with self._lock:
+                if not self._building:
+                    self._building = True
+                    threading.Thread(target=self._rebuild, daemon=True).start()
+        return gazetteer
+
+    def _rebuild(self):
+        generation = self.store.generation
+        try:
+            started = time.monotonic()
+            gazetteer = Gazetteer.build(self.store)
+            self.gazetteer = gazetteer
+            startup_profile.record("build gazetteer", time.monotonic() - started)
+            print(f"Gazetteer: {len(gazetteer)} names, {len(gazetteer.edges)} edges,"
+                  f" {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            self._failed = generation
+            print(f"Gazetteer build failed: {e!r}")
+        finally:
+            self._building = False
+
+
+gazetteer = GazetteerHolder(node_store)
@@ -0,0 +1,209 @@
+"""In-process typo-tolerant index of person names and movie titles.
+
+The fuzzy half of entity correction was a Lucene `~` query per word against
+`personNameIndex` and `movieTitleIndex` — over all 15M people, most of whom can
+never appear in a graph, and among the slowest queries the API runs. This
+answers the same question from memory, over only the nodes that carry a
+`pageRank` (the node store's nodes), and for movies over the localised titles
+too, so "Sueurs froides" corrects to "Vertigo".
+
+Candidates come from a character-trigram inverted index: the strings sharing
+the most trigrams with the query, `CANDIDATES` of them, are rescored with
+rapidfuzz's token_sort_ratio, and a tie between equally good spellings goes to
+the node with the higher pageRank. Not WRatio: it scales partial matches up, so
+a name's substring scores 90 and "Tom Cruise" would correct to a "Tom". The index is CSR-shaped numpy — trigram -> offsets
+into one int32 postings array — at about 4 bytes per trigram occurrence,
+rather than a Python set per trigram.
+
+Bounded by `NAME_INDEX_SIZE`: the best-ranked nodes of each kind, 0 for all of
+them. `stats()` reports what it holds and what it costs.
+"""
+
+import os
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from app.services.node_store import TABLES, node_store
+from app.services.startup import startup_profile
+from app.services.tools.titles import LANGUAGES
+
+NAME_INDEX_SIZE = int(os.getenv("NAME_INDEX_SIZE", "300000"))
+
+# Strings scored with rapidfuzz per lookup, and the score (0-100) a correction
+# needs. High on purpose: a wrong correction rewrites the user's question.
+CANDIDATES = 64
+MIN_SCORE = 85.0
+
+
+def _normalize(text):
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+def _trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """Trigram index over one kind of node's names (persons, or movies)."""
+
+    def __init__(self, strings, labels, ranks, vocabulary, offsets, postings):
+        self.strings = strings        # normalised searchable strings
+        self.labels = labels          # per string: the canonical node label
+        self.ranks = ranks            # per string: the node's pageRank
+        self.vocabulary = vocabulary  # trigram -> row in offsets
+        self.offsets = offsets
+        self.postings = postings
+
+    @classmethod
+    def build(cls, entries):
+        """From `(searchable string, canonical label, pageRank)` triples."""
+        strings, labels, ranks = [], [], []
+        vocabulary = {}
+        grams, docs = [], []
+        seen = set()
+        for text, label, rank in entries:
+            normalized = _normalize(text)
+            if not normalized or (normalized, label) in seen:
+                continue
+            seen.add((normalized, label))
+            doc = len(strings)
+            strings.append(normalized)
+            labels.append(label)
+            ranks.append(rank)
+            for gram in _trigrams(normalized):
+                grams.append(vocabulary.setdefault(gram, len(vocabulary)))
+                docs.append(doc)
+
+        grams = np.asarray(grams, dtype=np.int32)
+        order = np.argsort(grams, kind="stable")
+        postings = np.asarray(docs, dtype=np.int32)[order]
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(grams, minlength=len(vocabulary)), out=offsets[1:])
+        return cls(strings, labels, np.asarray(ranks, dtype=np.float32),
+                   vocabulary, offsets, postings)
+
+    def correct(self, name):
+        """The canonical label `name` most likely misspells, or None."""
+        query = _normalize(name)
+        rows = [self.vocabulary[g] for g in _trigrams(query) if g in self.vocabulary]
+        if not rows:
+            return None
+        hits = np.concatenate([self.postings[self.offsets[r]:self.offsets[r + 1]]
+                               for r in rows])
+        counts = np.bincount(hits)
+        top = np.flatnonzero(counts)
+        if len(top) > CANDIDATES:
+            top = top[np.argpartition(counts[top], len(top) - CANDIDATES)[-CANDIDATES:]]
+
+        scored = process.extract(query, {int(d): self.strings[d] for d in top},
+                                 scorer=fuzz.token_sort_ratio, processor=None,
+                                 score_cutoff=MIN_SCORE, limit=None)
+        if not scored:
+            return None
+        _, _, best = max(scored, key=lambda s: (s[1], self.ranks[s[2]]))
+        return self.labels[best]
+
+    def __len__(self):
+        return len(self.strings)
+
+    @property
+    def nbytes(self):
+        """Approximate: arrays exactly, Python strings and dicts estimated."""
+        strings = sum(49 + len(s) for s in self.strings)
+        return (self.offsets.nbytes + self.postings.nbytes + self.ranks.nbytes
+                + strings + 8 * len(self.labels) + 100 * len(self.vocabulary))
+
+
+def _entries(table, prefix, size):
+    """The searchable strings of the `size` best-ranked nodes in `table`."""
+    ranks = np.nan_to_num(np.asarray(table.centralities["pageRank"]), nan=0.0)
+    if 0 < size < len(ranks):
+        top = np.argpartition(ranks, len(ranks) - size)[-size:]
+    else:
+        top = np.arange(len(ranks))
+    variants = ["original"] + [f"title_{lang}" for lang in LANGUAGES] if prefix == "tt" else []
+    label_column = table.strings["label"]
+    for i in top:
+        label = label_column[i]
+        if not label:
+            continue
+        rank = float(ranks[i])
+        yield label, label, rank
+        for column in variants:
+            text = table.strings[column][i]
+            if text and text != label:
+                yield text, label, rank
+
+
+class NameIndexes:
+    """Person and movie indexes, rebuilt in the background as the store moves on."""
+
+    def __init__(self, store, size=NAME_INDEX_SIZE):
+        self.store = store
+        self.size = size
+        self.indexes = None
+        self.generation = None
+        self._building = False
+        self._failed = None  # generation whose build failed; not retried
+        self._lock = threading.Lock()
+
+    def correct(self, name, kind):
+        """Correct a "person" or "movie" name from memory.
+
+        None when there is no index yet, or nothing close enough: the caller
+        then asks Neo4j's full-text index instead.
+        """
+        self._refresh()
+        indexes = self.indexes
+        if indexes is None:
+            return None
+        return indexes[kind].correct(name)
+
+    def _refresh(self):
+        store = self.store
+        generation = store.generation
+        if not store.ready or generation in (self.generation, self._failed):
+            return
+        with self._lock:
+            if not self._building:
+                self._building = True
+                threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self):
+        generation = self.store.generation
+        try:
+            started = time.monotonic()
+            indexes = {
+                TABLES[prefix][0].lower(): NameIndex.build(_entries(table, prefix, self.size))
+                for prefix, table in self.store.tables.items()
+            }
+            self.indexes, self.generation = indexes, generation
+            startup_profile.record("build name index", time.monotonic() - started)
+            stats = self.stats()
+            print(f"Name index: {stats['strings']},"
+                  f" ~{stats['bytes'] / 2**20:.0f} MiB,"
+                  f" {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            self._failed = generation
+            print(f"Name index build failed: {e!r}")
+        finally:
+            self._building = False
+
+    def stats(self):
+        indexes = self.indexes or {}
+        return {
+            "ready": self.indexes is not None,
+            "generation": self.generation,
+            "limit": self.size,
+            "strings": {kind: len(index) for kind, index in indexes.items()},
+            "bytes": sum(index.nbytes for index in indexes.values()),
+        }
+
+
+name_index = NameIndexes(node_store)
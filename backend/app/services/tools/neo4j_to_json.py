@@ -1,45 +1,131 @@
+from neo4j.graph import Node, Path, Relationship
+
 from app.services.tools.titles import localised_titles
+from app.services.node_store import node_store
 
 
-def to_d3_format(results):
-    nodes = {}
-    links = []
+class D3Builder:
+    """Accumulates Neo4j rows into a D3 `{nodes, links}` payload.
+
+    Fed a record at a time, so a caller streaming rows off the cursor can send
+    each batch's new nodes and links on as soon as they exist; `to_d3_format`
+    is the same thing fed a whole result at once.
+
+    Takes raw driver records as well as `record.data()` dicts. Raw is the hot
+    path: a `Node` is read in place instead of first being copied into a dict
+    of every property, a relationship needs no `(start, type, end)` tuple of
+    two more such dicts, and each record is let go once folded, so a large
+    result never exists twice over. Paths, and lists of any of these (a
+    `collect()`), are unpacked too. Nodes and links are both deduplicated: a
+    pattern matched along several routes returns the same relationship on
+    several rows, and each copy used to become a link of its own.
+
+    Nodes may also come as map projections (see projection.py); one that
+    carries an `elementId` is what a raw relationship's ends are matched to.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.links = {}  # (source, target, label) -> link
+        self.records = 0
+        # element id -> D3 id, for relationships whose end nodes came without
+        # their properties: projected, or not returned at all.
+        self._element_ids = {}
+
+    def add(self, record):
+        """Fold one row in. Returns the nodes and links it added."""
+        new_nodes = []
+        new_links = []
+        relationships = []
+        self.records += 1
+        for value in record.values():
+            self._fold(value, new_nodes, new_links, relationships)
+        # After the row's nodes, whatever order the RETURN listed them in.
+        for relationship in relationships:
+            self._add_link(self._end_id(relationship.start_node),
+                           self._end_id(relationship.end_node),
+                           relationship.type, new_links)
+        return new_nodes, new_links
+
+    def _fold(self, value, new_nodes, new_links, relationships):
+        if isinstance(value, Node):
+            self._add_node(value, new_nodes)
+            self._element_ids[value.element_id] = _node_id(value)
+        elif isinstance(value, Relationship):
+            relationships.append(value)
+        elif isinstance(value, Path):
+            for node in value.nodes:
+                self._fold(node, new_nodes, new_links, relationships)
+            relationships.extend(value.relationships)
+        # Map projections, and the `record.data()` shapes: a node as its
+        # property dict, a relationship as a (start, type, end) tuple.
+        elif isinstance(value, dict) and ("personId" in value or "movieId" in value):
+            self._add_node(value, new_nodes)
+            if value.get("elementId"):
+                self._element_ids[value["elementId"]] = _node_id(value)
+        elif isinstance(value, tuple) and len(value) == 3:
+            src, rel, tgt = value
+            self._add_link(_node_id(src), _node_id(tgt), rel, new_links)
+        elif isinstance(value, list):
+            for item in value:
+                self._fold(item, new_nodes, new_links, relationships)
 
+    def _end_id(self, node):
+        if node is None:
+            return None
+        return _node_id(node) or self._element_ids.get(node.element_id)
+
+    def _add_node(self, value, new_nodes):
+        node_id = _node_id(value)
+        if node_id is None or node_id in self.nodes:
+            return
+        node = {
+            "id": node_id,
+            "label": value.get("name") or value.get("title"),
+            "type": "Person" if value.get("personId") else "Movie"
+        }
+        if node["type"] == "Movie" and value.get("year") is not None:
+            node["year"] = value["year"]
+        if node["type"] == "Movie":
+            titles = localised_titles(value)
+            if titles:
+                node["titles"] = titles
+        if value.get("betweennessCentrality") is not None:
+            node["betweennessCentrality"] = value["betweennessCentrality"]
+        # Whatever the statement left out of its RETURN, the
+        # store has — generated Cypher is not consistent about it.
+        node_store.enrich([node])
+        self.nodes[node_id] = node
+        new_nodes.append(node)
+
+    def _add_link(self, src_id, tgt_id, rel, new_links):
+        # A link to a node nobody can name would only dangle in the browser.
+        if src_id is None or tgt_id is None:
+            return
+        key = (src_id, tgt_id, rel)
+        if key in self.links:
+            return
+        link = {
+            "source": src_id,
+            "target": tgt_id,
+            "label": rel
+        }
+        self.links[key] = link
+        new_links.append(link)
+
+    def result(self):
+        return {
+            "nodes": list(self.nodes.values()),
+            "links": list(self.links.values())
+        }
+
+
+def _node_id(props):
+    return props.get("personId") or props.get("movieId")
+
+
+def to_d3_format(results):
+    builder = D3Builder()
     for record in results:
-        for key in record:
-            value = record[key]
-
-            # Add nodes
-            if isinstance(value, dict) and ("personId" in value or "movieId" in value):
-                node_id = value.get("personId") or value.get("movieId")
-                if node_id not in nodes:
-                    node = {
-                        "id": node_id,
-                        "label": value.get("name") or value.get("title"),
-                        "type": "Person" if "personId" in value else "Movie"
-                    }
-                    if node["type"] == "Movie" and "year" in value:
-                        node["year"] = value["year"]
-                    if node["type"] == "Movie":
-                        titles = localised_titles(value)
-                        if titles:
-                            node["titles"] = titles
-                    if "betweennessCentrality" in value:
-                        node["betweennessCentrality"] = value["betweennessCentrality"]
-                    nodes[node_id] = node
-
-            # Add relationships
-            elif isinstance(value, tuple) and len(value) == 3:
-                src, rel, tgt = value
-                src_id = src.get("personId") or src.get("movieId")
-                tgt_id = tgt.get("personId") or tgt.get("movieId")
-                links.append({
-                    "source": src_id,
-                    "target": tgt_id,
-                    "label": rel
-                })
-
-    return {
-        "nodes": list(nodes.values()),
-        "links": links
-    }
+        builder.add(record)
+    return builder.result()
@@ -0,0 +1,188 @@
+"""Return only the properties the D3 payload uses, not whole nodes.
+
+A node returned whole brings every property over Bolt: the 32-float
+`embedding`, the 128-float `embeddingSage`, four centralities, every
+`title_*`. The payload keeps an id, a label, a year, the localised titles and
+betweenness. Map projections — `p {.personId, .name}` — ship just those, an
+order of magnitude less per node.
+
+The expand queries write their projections out (see expand.py, from the field
+lists here). Generated Cypher is rewritten by `project_return`: in the final
+RETURN, a bare node variable becomes a projection of the fields for its label
+(both labels' when the pattern gave none), and a path variable its projected
+nodes followed by its relationships. Relationships stay as they are — they
+carry only their own few properties — and the node maps then carry their
+`elementId`, which is how a relationship's ends are matched to them.
+
+Anything else is left alone: expressions, aliases of variables a WITH renamed,
+`RETURN *`, UNIONs, and a statement the scanner cannot read. If the statement
+orders after its RETURN on a property the projection would drop, the property
+is kept.
+"""
+
+import re
+
+from app.services.tools.titles import LANGUAGES
+
+PERSON_FIELDS = ("personId", "name", "betweennessCentrality")
+MOVIE_FIELDS = (("movieId", "title", "year", "originalTitle")
+                + tuple(f"title_{lang}" for lang in LANGUAGES)
+                + ("betweennessCentrality",))
+FIELDS_BY_LABEL = {"Person": PERSON_FIELDS, "Movie": MOVIE_FIELDS}
+# For a node whose label the pattern does not say.
+ANY_FIELDS = PERSON_FIELDS + tuple(f for f in MOVIE_FIELDS if f not in PERSON_FIELDS)
+
+
+def map_projection(fields, variable=None):
+    """`{.a, .b}`, plus `elementId: elementId(<variable>)` when given one."""
+    entries = [f".{field}" for field in fields]
+    if variable is not None:
+        entries.append(f"elementId: elementId({variable})")
+    return "{" + ", ".join(entries) + "}"
+
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_NODE = re.compile(r"(?<![\w`])\(\s*([A-Za-z_]\w*)\s*(?::\s*`?(\w+)`?)?\s*[:){]")
+_RELATIONSHIP = re.compile(r"-\s*\[\s*([A-Za-z_]\w*)\s*[:\]*{]")
+_PATH = re.compile(r"(?:\bMATCH\b|,)\s*([A-Za-z_]\w*)\s*=\s*"
+                   r"(?:(?:all)?shortestPath\s*)?\(", re.IGNORECASE)
+_RETURN = re.compile(r"\bRETURN\b(\s+DISTINCT\b)?", re.IGNORECASE)
+_RETURN_END = re.compile(r"\b(?:ORDER\s+BY|SKIP|LIMIT)\b|;", re.IGNORECASE)
+_UNION = re.compile(r"\bUNION\b", re.IGNORECASE)
+_ITEM = re.compile(r"^\s*([A-Za-z_]\w*)\s*(?:\bAS\s+([A-Za-z_]\w*))?\s*$", re.IGNORECASE)
+
+
+def _mask(cypher, nested):
+    """`cypher` with strings and comments blanked, and with `nested` anything
+    inside brackets too, so the regexes only see what they should. Same
+    length, so offsets carry over. None if a string or comment is unterminated.
+    """
+    out = []
+    depth = 0
+    i, n = 0, len(cypher)
+    while i < n:
+        c = cypher[i]
+        if c in "'\"`":
+            end = i + 1
+            while end < n and cypher[end] != c:
+                end += 2 if cypher[end] == "\\" and c != "`" else 1
+            if end >= n:
+                return None
+            out.append(" " * (end + 1 - i))
+            i = end + 1
+            continue
+        if cypher.startswith("//", i) or cypher.startswith("/*", i):
+            end = cypher.find("\n" if c == "/" and cypher[i + 1] == "/" else "*/", i + 2)
+            if end < 0:
+                if cypher[i + 1] == "*":
+                    return None
+                end = n
+            elif cypher[i + 1] == "*":
+                end += 2
+            out.append(" " * (end - i))
+            i = end
+            continue
+        if c in "([{":
+            depth += 1
+            out.append(c if not nested or depth == 1 else " ")
+        elif c in ")]}":
+            depth -= 1
+            out.append(c if not nested or depth == 0 else " ")
+        else:
+            out.append(" " if nested and depth else c)
+        i += 1
+    return "".join(out)
+
+
+def _split_items(text, masked):
+    """Split the RETURN items on top-level commas: `(start, end)` offsets."""
+    spans = []
+    start = 0
+    for i, c in enumerate(masked):
+        if c == ",":
+            spans.append((start, i))
+            start = i + 1
+    spans.append((start, len(text)))
+    return spans
+
+
+def _kinds(strings_masked):
+    """What each variable is: ("node", label or None), ("relationship",) or ("path",)."""
+    kinds = {}
+    for match in _PATH.finditer(strings_masked):
+        kinds[match.group(1)] = ("path",)
+    for match in _RELATIONSHIP.finditer(strings_masked):
+        kinds.setdefault(match.group(1), ("relationship",))
+    for match in _NODE.finditer(strings_masked):
+        variable, label = match.groups()
+        known = kinds.get(variable)
+        if known is None or (known[0] == "node" and known[1] is None and label):
+            kinds[variable] = ("node", label)
+    return kinds
+
+
+def _fresh_variable(cypher, base="n"):
+    """`base`, or `base1`, `base2`...: the first the statement does not use."""
+    used = set(_WORD.findall(cypher))
+    name, i = base, 0
+    while name in used:
+        i += 1
+        name = f"{base}{i}"
+    return name
+
+
+def project_return(cypher):
+    """`cypher` with the nodes and paths of its final RETURN projected."""
+    strings_masked = _mask(cypher, nested=False)
+    top = _mask(cypher, nested=True)
+    if strings_masked is None or top is None or _UNION.search(top):
+        return cypher
+    returns = list(_RETURN.finditer(top))
+    if not returns:
+        return cypher
+    start = returns[-1].end()
+    tail = _RETURN_END.search(top, start)
+    end = tail.start() if tail else len(cypher)
+    kinds = _kinds(strings_masked)
+
+    items = []
+    for a, b in _split_items(cypher[start:end], top[start:end]):
+        match = _ITEM.match(cypher[start + a:start + b])
+        if match is None or match.group(1) not in kinds:
+            items.append((a, b, None, None, None))
+        else:
+            variable, alias = match.groups()
+            items.append((a, b, variable, alias or variable, kinds[variable]))
+    with_links = any(k is not None and k[0] in ("relationship", "path")
+                     for *_, k in items)
+    # Properties the ORDER BY after the RETURN reads off a projected alias.
+    order_by = cypher[end:] if tail else ""
+    extra = {}
+    for match in re.finditer(r"\b([A-Za-z_]\w*)\s*\.\s*([A-Za-z_]\w*)", order_by):
+        extra.setdefault(match.group(1), []).append(match.group(2))
+
+    out = []
+    cursor = 0
+    for a, b, variable, alias, kind in items:
+        if kind is None or kind[0] == "relationship":
+            continue
+        if kind[0] == "node":
+            fields = FIELDS_BY_LABEL.get(kind[1], ANY_FIELDS)
+            fields = fields + tuple(f for f in extra.get(alias, ()) if f not in fields)
+            projection = map_projection(fields, variable if with_links else None)
+            replacement = f"{variable} {projection} AS {alias}"
+        else:
+            # Its own name: an `n` of the statement's may be in this RETURN too.
+            each = _fresh_variable(cypher)
+            projection = map_projection(ANY_FIELDS, each)
+            replacement = (f"[{each} IN nodes({variable}) | {each} {projection}]"
+                           f" + relationships({variable}) AS {alias}")
+        # Keep the whitespace around the item as it was.
+        text = cypher[start + a:start + b]
+        lead = len(text) - len(text.lstrip())
+        trail = len(text.rstrip())
+        out.append(cypher[cursor:start + a + lead])
+        out.append(replacement)
+        cursor = start + a + trail
+    out.append(cypher[cursor:])
+    return "".join(out)
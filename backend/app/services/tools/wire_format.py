@@ -0,0 +1,124 @@
+"""Compact wire formats for D3 payloads, negotiated through `Accept`.
+
+The default `{nodes, links}` JSON spells out everything on every row: each link
+repeats two full ids and its label, each node its `"type": "Person"`. At
+node_limit=500 that is most of the bytes, and most of the serialisation work.
+
+The compact layout is columnar:
+
+    {
+      "format": "compact/1",
+      "types":  ["Person", "Movie"],            # enum table for nodes.type
+      "labels": ["ACTED_IN", "DIRECTED", ...],  # enum table for link labels/roles
+      "nodes": {
+        "count": 2,                             # rows that carry attributes
+        "id":    ["nm0000033", "tt0052357", "nm0000071"],
+        "type":  [0, 1],
+        "label": ["Alfred Hitchcock", "Vertigo"],
+        "year":  [null, "1958"],                # one column per node field,
+        ...                                     # null where a node lacks it
+      },
+      "links": [2, 1, 0, ...],                  # flat (source, target, label)
+                                                # triples of indexes
+      ...                                       # every other top-level key as is
+    }
+
+Links point into `nodes.id`. Rows past `count` are references only — an id a
+link mentions without the payload describing it (generated Cypher can return a
+relationship without one of its ends), so there is nothing but the id to send.
+`subjectRoles` is coded through `labels` like link labels are.
+
+Served as JSON (`application/vnd.imdbgraph.compact+json`) or MessagePack
+(`application/x-msgpack`, when the `msgpack` package is installed). Plain JSON
+stays the default for any client that asks for neither.
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:  # optional: without it, MessagePack is simply not offered
+    msgpack = None
+
+JSON = "application/json"
+COMPACT_JSON = "application/vnd.imdbgraph.compact+json"
+MSGPACK = "application/x-msgpack"
+
+NODE_TYPES = ("Person", "Movie")
+
+
+def negotiate(accept):
+    """The media type to answer an `Accept` header with.
+
+    First match in the client's order; no q-value weighing, which no client of
+    this API sends. Anything unrecognised gets the default JSON.
+    """
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type == COMPACT_JSON:
+            return COMPACT_JSON
+        if media_type in (MSGPACK, "application/msgpack") and msgpack is not None:
+            return MSGPACK
+        if media_type in (JSON, "*/*"):
+            return JSON
+    return JSON
+
+
+def to_compact(d3_data):
+    """The columnar layout above, from a D3 payload."""
+    nodes = d3_data.get("nodes", [])
+    index = {}
+    ids = []
+
+    def intern(node_id):
+        i = index.get(node_id)
+        if i is None:
+            i = index[node_id] = len(ids)
+            ids.append(node_id)
+        return i
+
+    labels = {}
+
+    def code(label):
+        return labels.setdefault(label, len(labels))
+
+    types = {t: i for i, t in enumerate(NODE_TYPES)}
+    columns = {}
+    for row, node in enumerate(nodes):
+        intern(node["id"])
+        for field, value in node.items():
+            if field == "id":
+                continue
+            if field == "type":
+                value = types.get(value, value)
+            elif field == "subjectRoles":
+                value = [code(role) for role in value]
+            column = columns.get(field)
+            if column is None:
+                column = columns[field] = [None] * len(nodes)
+            column[row] = value
+
+    links = []
+    for link in d3_data.get("links", []):
+        links += (intern(link["source"]), intern(link["target"]), code(link["label"]))
+
+    compact = {key: value for key, value in d3_data.items()
+               if key not in ("nodes", "links")}
+    compact.update({
+        "format": "compact/1",
+        "types": list(NODE_TYPES),
+        "labels": list(labels),
+        "nodes": {"count": len(nodes), "id": ids, **columns},
+        "links": links,
+    })
+    return compact
+
+
+def encode(payload, media_type):
+    """Serialise `payload` for `media_type`; JSON the way FastAPI writes it."""
+    if media_type == MSGPACK:
+        return msgpack.packb(to_compact(payload), use_bin_type=True)
+    if media_type == COMPACT_JSON:
+        payload = to_compact(payload)
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,313 @@
+"""Concurrency load test: how many users one uvicorn worker takes.
+
+    cd backend
+    python -m bench.load                                   # chat-heavy, stub graph
+    python -m bench.load --mix drilldown --users 1 4 16 64
+    python -m bench.load --mix replay --llm-latency 1500 --cold
+    python -m bench.load --url http://localhost:8000       # a server already up
+    python -m bench.load --compare bench/results/a.json bench/results/b.json
+
+Closed loop: at each step of `--users`, that many simulated users run for
+`--duration` seconds, each sending its next request as soon as the last one
+answered (plus `--think-ms`). A user does one of:
+
+    chat      POST /chat with a recorded question
+    expand    GET /expand/person/{id} or /expand/movie/{id}, a node it has seen
+    batch     POST /expand/batch with a few nodes it has seen
+    replay    Back/Forward: GET a drill-down it made before, with the ETag it
+              got, as the browser revalidates — a 304 when the cache is warm
+
+in the proportions of `--mix` (`MIXES`). Unless `--url` is given a server is
+started with `bench.serve`, stub graph and replayed LLM included.
+
+Per step the report has throughput, error rate, p50/p95/p99 overall and per
+operation; `saturation` is the first step within 5% of the peak throughput —
+past it, more users only queue. Results go to `bench/results/` as JSON and a
+CSV of the curve, named by mix and commit, to set side by side with
+`--compare`.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from bench.run import BENCH_DIR, FIXTURES, REPO_ROOT
+
+RESULTS_DIR = BENCH_DIR / "results"
+
+MIXES = {
+    "chat": {"chat": 0.6, "expand": 0.3, "replay": 0.1},
+    "drilldown": {"chat": 0.1, "expand": 0.6, "batch": 0.1, "replay": 0.2},
+    "replay": {"chat": 0.05, "expand": 0.25, "replay": 0.7},
+}
+
+# Within this share of the peak, another step of users bought nothing.
+SATURATION_SHARE = 0.95
+
+
+class User:
+    """One browser tab: the nodes it has on screen and the drill-downs it made."""
+
+    def __init__(self, client, mix, questions, seeds, rng):
+        self.client = client
+        self.mix = mix
+        self.questions = questions
+        self.seeds = list(seeds)
+        self.history = []  # (url, etag)
+        self.rng = rng
+        self.session = f"load-{rng.getrandbits(48):x}"
+
+    def _pick(self):
+        ops, weights = zip(*self.mix.items())
+        op = self.rng.choices(ops, weights)[0]
+        return "expand" if op == "replay" and not self.history else op
+
+    async def step(self):
+        op = self._pick()
+        if op == "chat":
+            response = await self.client.post(
+                "/chat", json={"message": self.rng.choice(self.questions), "history": []},
+                headers={"Session-Id": self.session})
+            if response.status_code == 200:
+                self._see(response.json())
+        elif op == "expand":
+            kind, node_id = self.rng.choice(self.seeds)
+            url = f"/expand/{kind}/{node_id}"
+            response = await self.client.get(url)
+            if response.status_code == 200:
+                self.history.append((url, response.headers.get("etag")))
+                self._see(response.json())
+        elif op == "batch":
+            seeds = self.rng.sample(self.seeds, min(len(self.seeds), 4))
+            response = await self.client.post("/expand/batch", json={
+                kind + "s": [{"id": node_id} for k, node_id in seeds if k == kind]
+                for kind in ("person", "movie")})
+            if response.status_code == 200:
+                self._see(response.json())
+        else:
+            url, etag = self.rng.choice(self.history)
+            response = await self.client.get(url, headers={"If-None-Match": etag} if etag else {})
+        return op, response.status_code
+
+    def _see(self, d3):
+        for node in d3.get("nodes", [])[:20]:
+            kind = "person" if node["id"].startswith("nm") else "movie"
+            self.seeds.append((kind, node["id"]))
+        del self.seeds[:-500]
+
+
+async def _user_loop(user, deadline, think, samples):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            op, status = await user.step()
+        except httpx.HTTPError as e:
+            op, status = "error", type(e).__name__
+        samples.append((op, status, time.perf_counter() - started))
+        if think:
+            await asyncio.sleep(think)
+
+
+def _latencies(samples):
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray([s[2] for s in samples]) * 1000
+    return {"n": len(samples),
+            "p50": round(float(np.percentile(ms, 50)), 2),
+            "p95": round(float(np.percentile(ms, 95)), 2),
+            "p99": round(float(np.percentile(ms, 99)), 2),
+            "max": round(float(ms.max()), 2)}
+
+
+async def run_step(base_url, users, args, questions, seeds, seed):
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    timeout = httpx.Timeout(args.timeout)
+    samples = []
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        rng = random.Random(seed)
+        crowd = [User(client, MIXES[args.mix], questions, seeds, random.Random(rng.random()))
+                 for _ in range(users)]
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*(_user_loop(u, deadline, args.think_ms / 1000, samples)
+                               for u in crowd))
+        elapsed = time.monotonic() - started
+    ok = [s for s in samples if s[1] in (200, 304)]
+    step = {"users": users, "seconds": round(elapsed, 2), "requests": len(samples),
+            "throughput": round(len(ok) / elapsed, 2),
+            "errorRate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+            "latencyMs": _latencies(samples), "operations": {}}
+    for op in sorted({s[0] for s in samples}):
+        of_op = [s for s in samples if s[0] == op]
+        step["operations"][op] = {**_latencies(of_op),
+                                  "notModified": sum(s[1] == 304 for s in of_op),
+                                  "errors": sum(s[1] not in (200, 304) for s in of_op)}
+    return step
+
+
+def saturation(steps):
+    """The users count where throughput stopped growing."""
+    if not steps:
+        return None
+    peak = max(s["throughput"] for s in steps)
+    for step in steps:
+        if step["throughput"] >= SATURATION_SHARE * peak:
+            return {"users": step["users"], "throughput": step["throughput"],
+                    "p95Ms": step["latencyMs"].get("p95")}
+    return None
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args):
+    """`bench.serve` in a subprocess; returns it and its base URL once ready."""
+    port = _free_port()
+    command = [sys.executable, "-m", "bench.serve", "--port", str(port),
+               "--backend", args.backend, "--llm-latency", str(args.llm_latency)]
+    if args.cold:
+        command.append("--cold")
+    # The app prints every step of every request; that is part of the load,
+    # but not of the output.
+    server = subprocess.Popen(command, cwd=BENCH_DIR.parent,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("bench.serve exited:\n" + server.stderr.read().decode())
+        try:
+            if httpx.get(base_url + "/ready", timeout=2).status_code == 200:
+                return server, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    server.terminate()
+    raise RuntimeError("bench.serve did not become ready")
+
+
+def _seeds(path):
+    with open(path) as f:
+        nodes = json.load(f)["nodes"]
+    return [("person" if n["id"].startswith("nm") else "movie", n["id"]) for n in nodes]
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(report, out):
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2) + "\n")
+    with open(out.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["users", "throughput", "errorRate", "p50", "p95", "p99"])
+        for step in report["steps"]:
+            latency = step["latencyMs"]
+            writer.writerow([step["users"], step["throughput"], step["errorRate"],
+                             latency.get("p50"), latency.get("p95"), latency.get("p99")])
+    return out
+
+
+def _print_step(step):
+    latency = step["latencyMs"]
+    print(f"{step['users']:>6} {step['throughput']:>10.1f} {step['errorRate']:>7.1%}"
+          f" {latency.get('p50', 0):>9.1f} {latency.get('p95', 0):>9.1f}"
+          f" {latency.get('p99', 0):>9.1f}", flush=True)
+
+
+def compare(paths):
+    reports = [json.loads(Path(p).read_text()) for p in paths]
+    print("users " + "".join(f"{r['commit'] + ' ' + r['mix']:>28}" for r in reports))
+    print("      " + "".join(f"{'req/s':>10} {'p95 ms':>9} {'err':>7}" for _ in reports))
+    levels = sorted({s["users"] for r in reports for s in r["steps"]})
+    for users in levels:
+        line = f"{users:>5} "
+        for report in reports:
+            step = next((s for s in report["steps"] if s["users"] == users), None)
+            if step is None:
+                line += " " * 28
+            else:
+                line += (f"{step['throughput']:>10.1f} {step['latencyMs'].get('p95', 0):>9.1f}"
+                         f" {step['errorRate']:>7.1%}")
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mix", choices=sorted(MIXES), default="chat")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per step")
+    parser.add_argument("--think-ms", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=60.0, help="per request, seconds")
+    parser.add_argument("--url", help="load this server instead of starting one")
+    parser.add_argument("--backend", choices=("stub", "neo4j"), default="stub")
+    parser.add_argument("--llm-latency", type=float, default=800.0,
+                        help="simulated LLM round trip, ms")
+    parser.add_argument("--cold", action="store_true",
+                        help="serve with the Cypher and result caches off")
+    parser.add_argument("--seeds", default=str(REPO_ROOT / "graph_data.json"),
+                        help="D3 graph whose nodes users start drilling from")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--out", help="result file (default bench/results/<mix>-<commit>.json)")
+    parser.add_argument("--compare", nargs="+", metavar="RESULT",
+                        help="print saved results side by side and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(args.compare)
+        return 0
+
+    questions = list(json.loads(FIXTURES.read_text())["extract"])
+    seeds = _seeds(args.seeds)
+    server = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        server, base_url = start_server(args)
+    report = {"commit": _commit(), "mix": args.mix, "weights": MIXES[args.mix],
+              "url": args.url, "backend": None if args.url else args.backend,
+              "llmLatencyMs": None if args.url else args.llm_latency,
+              "cold": args.cold, "durationSeconds": args.duration,
+              "thinkMs": args.think_ms, "steps": []}
+    print(f"{'users':>6} {'req/s':>10} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    try:
+        for users in args.users:
+            step = asyncio.run(run_step(base_url, users, args, questions, seeds,
+                                        args.seed + users))
+            report["steps"].append(step)
+            _print_step(step)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    report["saturation"] = saturation(report["steps"])
+    out = write_results(report, args.out or RESULTS_DIR / f"{args.mix}-{report['commit']}.json")
+    if report["saturation"]:
+        print(f"Saturates at {report['saturation']['users']} users,"
+              f" {report['saturation']['throughput']} req/s")
+    print(f"Wrote {out} and {out.with_suffix('.csv').name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""Per-stage latency benchmark of the chat and drill-down paths.
+
+    cd backend
+    python -m bench.run                          # stub graph, recorded LLM
+    python -m bench.run --save-baseline          # write bench/baseline.json
+    python -m bench.run --baseline bench/baseline.json   # exit 1 on regression
+    python -m bench.run --backend neo4j          # NEO4J_* from the environment
+    python -m bench.run --record                 # refresh fixtures from OpenAI
+
+No OpenAI key and no database needed by default. LLM calls are answered from
+`fixtures/llm.json`, with `--llm-latency` to put a realistic round trip back.
+Neo4j is `stub.StubGraph`, built from the repository's saved `graph_data.json`.
+Each stage is timed on its own, caches bypassed, and reported as p50/p95/p99 in
+milliseconds:
+
+    map_entities     gazetteer / LLM extraction + name correction
+    generate_cypher  the above, the Cypher LLM call, and the EXPLAIN guard
+    graph_query      streaming the generated statement's raw records, as
+                     rewritten and guarded (projected, parameterised)
+    to_d3_format     raw records -> D3 payload through D3Builder, node store
+                     enrichment included
+    expand_person    GET /expand/person's work, minus HTTP
+    expand_movie     GET /expand/movie's work, minus HTTP
+    expand_batch     POST /expand/batch's work for both seeds, minus HTTP
+
+A baseline is just a saved report. Against one, a stage regresses when its p50
+or p95 grew by more than `--tolerance` and by more than `--noise-ms`, so that
+sub-millisecond jitter on a fast stage does not fail the run.
+"""
+
+import argparse
+import ast
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent.parent
+FIXTURES = BENCH_DIR / "fixtures" / "llm.json"
+
+PERSON_SEED = "nm0578483"  # Jean-Pierre Melville, in graph_data.json
+MOVIE_SEED = "tt0067900"   # Un flic
+
+_EXTRACT = re.compile(r"Question: (.*)\n\nJSON:\s*$", re.S)
+_CYPHER = re.compile(r"Question:\n(.*)\n\nCypher Query:\s*$", re.S)
+
+
+def _prompt_key(prompt):
+    """`(kind, question)` for one of the two prompts the chat path sends."""
+    for kind, pattern in (("extract", _EXTRACT), ("cypher", _CYPHER)):
+        match = pattern.search(prompt)
+        if match:
+            question = match.group(1)
+            # POST /chat passes the message history; the prompt then holds its
+            # repr, and the question is the last turn.
+            if question.startswith("[{"):
+                question = ast.literal_eval(question)[-1]["content"]
+            return kind, question
+    raise ValueError("Unrecognised prompt; the benchmark replays the separate-mode "
+                     "extraction and Cypher prompts only")
+
+
+class Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class FixtureLLM:
+    """Replays recorded responses, after `latency` seconds."""
+
+    def __init__(self, fixtures, latency=0.0):
+        self.fixtures = fixtures
+        self.latency = latency
+
+    async def ainvoke(self, prompt):
+        kind, question = _prompt_key(prompt)
+        try:
+            content = self.fixtures[kind][question]
+        except KeyError:
+            raise KeyError(f"No recorded {kind} response for {question!r};"
+                           " run with --record to add one") from None
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return Message(content)
+
+
+class RecordingLLM:
+    """The real model, remembering what it answered."""
+
+    def __init__(self, llm, fixtures):
+        self.llm = llm
+        self.fixtures = fixtures
+
+    async def ainvoke(self, prompt):
+        response = await self.llm.ainvoke(prompt)
+        kind, question = _prompt_key(prompt)
+        self.fixtures.setdefault(kind, {})[question] = response.content
+        return response
+
+
+def _percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {"p50": round(float(np.percentile(ms, 50)), 3),
+            "p95": round(float(np.percentile(ms, 95)), 3),
+            "p99": round(float(np.percentile(ms, 99)), 3),
+            "n": len(samples)}
+
+
+async def _time(fn, args_cycle, iterations, warmup):
+    for i in range(warmup):
+        await fn(*args_cycle[i % len(args_cycle)])
+    samples = []
+    for i in range(iterations):
+        args = args_cycle[i % len(args_cycle)]
+        started = time.perf_counter()
+        await fn(*args)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _use_stub(graph):
+    """Point every module holding the driver at the stub, and warm the stores."""
+    import app.services.graph as graph_module
+    from app.services.node_store import NodeTable, node_store
+    from app.services.tools import cypher_guard
+
+    graph_module.async_driver = graph
+    cypher_guard.async_driver = graph
+    node_store.tables = {prefix: NodeTable.build(collected, columns)
+                         for prefix, (collected, columns) in graph.node_columns().items()}
+    node_store.generation = graph.generation
+
+
+async def _wait_for_indexes(timeout=30.0):
+    from app.services.tools.gazetteer import gazetteer
+    from app.services.tools.name_index import name_index
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        name_index._refresh()
+        if gazetteer.current() is not None and name_index.indexes is not None:
+            return
+        await asyncio.sleep(0.05)
+    raise RuntimeError("gazetteer / name index did not build")
+
+
+async def run(args):
+    import app.services.llm as llm_module
+    from app.services.cypher_cache import cypher_cache
+    from app.services.graph import stream_query
+    from app.services.schema import schema_store
+    from app.services.tools.cypher_to_d3 import RECORD_FETCH_SIZE, _generate_cypher
+    from app.services.tools.entity_mapper import map_entities
+    from app.services.tools.expand import expand_batch, expand_movie, expand_person
+    from app.services.tools.neo4j_to_json import D3Builder
+
+    fixtures = json.loads(FIXTURES.read_text())
+    if args.record:
+        llm_module._llm = RecordingLLM(llm_module.get_llm(), fixtures)
+    else:
+        llm_module._llm = FixtureLLM(fixtures, latency=args.llm_latency / 1000)
+
+    if args.backend == "stub":
+        from bench.stub import StubGraph
+
+        _use_stub(StubGraph(args.graph))
+        schema_store.schema = fixtures["schema"]
+        schema_store.generation = 1
+    else:
+        from app.services.graph import current_generation
+        from app.services.node_store import node_store
+
+        # What the lifespan's keep_warm would do, once.
+        await asyncio.to_thread(node_store.warm, await current_generation())
+    await _wait_for_indexes()
+    schema = await schema_store.current()
+    if args.record:
+        fixtures["schema"] = schema
+
+    # Generation is measured, not served from the cache; nothing persists.
+    cypher_cache._db = None
+    questions = list(fixtures["extract"])
+
+    async def generate(question):
+        cypher_cache.memory.clear()
+        return await _generate_cypher(question, schema)
+
+    async def graph_query(cypher, params):
+        # As cypher_qa_tool fetches it: the driver's own records, in one batch.
+        async with stream_query(cypher, params, fetch_size=RECORD_FETCH_SIZE,
+                                source="cypher_to_d3", raw=True) as cursor:
+            return [record async for record in cursor]
+
+    # One pass outside the timings, for the statements and records the later
+    # stages take as input: each the statement the app would run.
+    statements = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for question in questions:
+            generated = await generate(question)
+            statements.append(generated["prepared"])
+        results = [await graph_query(cypher, params) for cypher, params in statements]
+
+    async def d3(records):
+        builder = D3Builder()
+        for record in records:
+            builder.add(record)
+        builder.result()
+
+    stages = {
+        "map_entities": (map_entities, [(q,) for q in questions]),
+        "generate_cypher": (generate, [(q,) for q in questions]),
+        "graph_query": (graph_query, statements),
+        "to_d3_format": (d3, [(records,) for records in results]),
+        "expand_person": (expand_person, [(args.person, args.node_limit)]),
+        "expand_movie": (expand_movie, [(args.movie,)]),
+        "expand_batch": (expand_batch, [([(args.person, args.node_limit)],
+                                         [(args.movie, 200)])]),
+    }
+    report = {"backend": args.backend, "iterations": args.iterations,
+              "llmLatencyMs": args.llm_latency, "stages": {}}
+    iterations = 1 if args.record else args.iterations
+    for name, (fn, args_cycle) in stages.items():
+        if args.stages and name not in args.stages:
+            continue
+        # The app logs every step; keep that out of the report, not out of
+        # the timings — it is part of the real path too.
+        with contextlib.redirect_stdout(io.StringIO()):
+            samples = await _time(fn, args_cycle, iterations, 0 if args.record else args.warmup)
+        report["stages"][name] = _percentiles(samples)
+
+    if args.record:
+        FIXTURES.write_text(json.dumps(fixtures, ensure_ascii=False, indent=2) + "\n")
+        print(f"Recorded responses to {FIXTURES}")
+    return report
+
+
+def compare(report, baseline, tolerance, noise_ms):
+    """Stages slower than the baseline, as printable lines."""
+    regressions = []
+    for name, now in report["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if before is None:
+            continue
+        for pct in ("p50", "p95"):
+            grown = now[pct] - before[pct]
+            if grown > noise_ms and now[pct] > before[pct] * (1 + tolerance):
+                regressions.append(f"{name} {pct}: {before[pct]:.3f} -> {now[pct]:.3f} ms")
+    return regressions
+
+
+def _print(report, baseline):
+    print(f"{'stage':<16} {'p50':>9} {'p95':>9} {'p99':>9}   (ms, n={report['iterations']},"
+          f" backend={report['backend']}, llm latency={report['llmLatencyMs']}ms)")
+    for name, stats in report["stages"].items():
+        line = f"{name:<16} {stats['p50']:>9.3f} {stats['p95']:>9.3f} {stats['p99']:>9.3f}"
+        before = (baseline or {}).get("stages", {}).get(name)
+        if before:
+            line += f"   baseline p50 {before['p50']:.3f}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("stub", "neo4j"), default="stub")
+    parser.add_argument("--graph", default=str(REPO_ROOT / "graph_data.json"),
+                        help="saved D3 graph the stub is built from")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="simulated LLM round trip, ms")
+    parser.add_argument("--person", default=PERSON_SEED)
+    parser.add_argument("--movie", default=MOVIE_SEED)
+    parser.add_argument("--node-limit", type=int, default=200)
+    parser.add_argument("--stages", nargs="*", help="only these stages")
+    parser.add_argument("--baseline", help="compare against this saved report")
+    parser.add_argument("--save-baseline", nargs="?", const=str(BENCH_DIR / "baseline.json"),
+                        help="write the report here (default bench/baseline.json)")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative growth before a stage regresses")
+    parser.add_argument("--noise-ms", type=float, default=0.5,
+                        help="growth below this is never a regression")
+    parser.add_argument("--json", help="also write the report here")
+    parser.add_argument("--record", action="store_true",
+                        help="call the real LLM once per prompt and save the fixtures")
+    args = parser.parse_args(argv)
+    # Before the run: a gate pointed at a missing file must fail, not pass.
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f"baseline {args.baseline} does not exist;"
+                     " write one with --save-baseline")
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+    _print(report, baseline)
+    for path in (args.json, args.save_baseline):
+        if path:
+            Path(path).write_text(json.dumps(report, indent=2) + "\n")
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance, args.noise_ms)
+        for line in regressions:
+            print("REGRESSION " + line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""One uvicorn worker of the API, with the LLM replayed, for load tests.
+
+    cd backend
+    python -m bench.serve --port 8765 --llm-latency 800
+    python -m bench.serve --backend neo4j --cold
+
+LLM calls are answered from `fixtures/llm.json` after `--llm-latency` ms, so
+the worker spends its time the way it would against OpenAI — waiting — without
+the bill or the rate limits. `--backend stub` (the default) serves the graph
+from `graph_data.json` in-process; `neo4j` uses NEO4J_* as the app does.
+
+`--cold` sizes the Cypher and result caches to zero, so every chat pays for
+generation and the query; without it the handful of recorded questions are
+cache hits after the first round, which is a measurement too, just a different
+one. `bench.load` starts this for you unless given `--url`.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--backend", choices=("stub", "neo4j"), default="stub")
+    parser.add_argument("--graph", help="saved D3 graph the stub is built from")
+    parser.add_argument("--llm-latency", type=float, default=800.0,
+                        help="simulated LLM round trip, ms")
+    parser.add_argument("--cold", action="store_true",
+                        help="disable the Cypher and result caches")
+    args = parser.parse_args(argv)
+
+    # Read at import by the cache modules, so set before anything imports them.
+    if args.cold:
+        os.environ["CYPHER_CACHE_SIZE"] = "0"
+        os.environ["CYPHER_CACHE_PATH"] = ""
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+
+    import uvicorn
+
+    import app.services.llm as llm_module
+    from app.api import api
+    from bench.run import FIXTURES, REPO_ROOT, FixtureLLM, _use_stub, _wait_for_indexes
+
+    fixtures = json.loads(FIXTURES.read_text())
+    llm_module._llm = FixtureLLM(fixtures, latency=args.llm_latency / 1000)
+    if args.backend == "stub":
+        from app.services.schema import schema_store
+        from bench.stub import StubGraph
+
+        _use_stub(StubGraph(args.graph or str(REPO_ROOT / "graph_data.json")))
+        schema_store.schema = fixtures["schema"]
+        schema_store.generation = 1
+        # Nothing here is bound to an event loop, so the indexes can be built
+        # before uvicorn starts its own.
+        asyncio.run(_wait_for_indexes())
+
+    uvicorn.run(api, host=args.host, port=args.port, workers=1, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""A stand-in for Neo4j built from a saved D3 graph (`graph_data.json`).
+
+Answers the statements the chat and drill-down paths send — by recognising
+them, not by executing Cypher — as the driver's own `Record`s, so everything
+downstream of the driver runs for real, `record.data()` and raw alike.
+Generated Cypher, which cannot be recognised, gets the person-[role]->movie
+rows around whichever names the statement or its parameters mention, capped
+at 60 like the prompt asks: `neo4j.graph` Nodes and Relationships, or for a
+statement `project_return` rewrote, the projected maps with their `elementId`
+beside Relationships whose ends carry nothing else — what Neo4j sends.
+
+Timings against it measure the application's own work. They say nothing about
+Neo4j; `--backend neo4j` is for that.
+"""
+
+import asyncio
+import json
+import re
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from neo4j import Record
+from neo4j.graph import Graph, Node
+from rapidfuzz import fuzz, process
+
+from app.services.generation import READ_GENERATION_CYPHER
+from app.services.tools.expand import (EXPAND_MOVIE_CYPHER, EXPAND_MOVIES_BATCH_CYPHER,
+                                       EXPAND_PERSON_CREW_CYPHER, EXPAND_PERSON_CYPHER,
+                                       EXPAND_PERSONS_BATCH_CYPHER)
+
+GENERATED_LIMIT = 60
+
+
+class StubSummary:
+    def __init__(self, plan=None):
+        self.plan = plan
+        self.profile = None
+        self.result_available_after = 0
+        self.result_consumed_after = 0
+
+
+class StubResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for row in self._rows:
+            yield Record(row)
+
+    async def consume(self):
+        return StubSummary()
+
+
+class StubSession:
+    def __init__(self, graph):
+        self.graph = graph
+
+    async def run(self, query, params=None):
+        await asyncio.sleep(0)
+        return StubResult(self.graph.answer(getattr(query, "text", query), params or {}))
+
+    async def close(self):
+        pass
+
+
+class StubGraph:
+    """The saved graph, indexed for the handful of lookups the queries need."""
+
+    def __init__(self, path, generation=1):
+        with open(path) as f:
+            data = json.load(f)
+        self.generation = generation
+        self.props = {}
+        for node in data["nodes"]:
+            if node["type"] == "Person":
+                self.props[node["id"]] = {"personId": node["id"], "name": node["label"]}
+            else:
+                props = {"movieId": node["id"], "title": node["label"]}
+                if node.get("year"):
+                    props["year"] = node["year"]
+                self.props[node["id"]] = props
+        # (person, movie) -> roles; the saved links repeat some pairs.
+        self.roles = defaultdict(set)
+        for link in data["links"]:
+            self.roles[(link["source"], link["target"])].add(link["label"])
+        degree = defaultdict(int)
+        for person, movie in self.roles:
+            degree[person] += 1
+            degree[movie] += 1
+        # No centralities in a D3 export: degree stands in for both orderings.
+        for node_id, props in self.props.items():
+            props["degreeCentrality"] = degree[node_id]
+            props["pageRank"] = float(degree[node_id])
+        self.by_name = {self._name(p).casefold(): i for i, p in self.props.items()}
+        # As the driver hydrates them, for generated statements.
+        self.graph = Graph()
+        self.nodes = {}
+        for number, (node_id, props) in enumerate(self.props.items()):
+            label = "Person" if "personId" in props else "Movie"
+            self.nodes[node_id] = Node(self.graph, f"4:stub:{number}", number, [label], props)
+        # (person, role, movie) -> (relationship, the same with bare ends): a
+        # relationship returned without its nodes has ends that carry only
+        # their element ids.
+        self.relationships = {}
+        for (person, movie), roles in self.roles.items():
+            p, m = self.nodes[person], self.nodes[movie]
+            for role in sorted(roles):
+                element_id = f"5:stub:{len(self.relationships)}"
+                self.relationships[(person, role, movie)] = (
+                    self._relationship(element_id, p, role, m),
+                    self._relationship(element_id, Node(self.graph, p.element_id, p.id), role,
+                                       Node(self.graph, m.element_id, m.id)))
+
+    def _relationship(self, element_id, start, type_, end):
+        relationship = self.graph.relationship_type(type_)(
+            self.graph, element_id, int(element_id.rsplit(":", 1)[1]), {})
+        relationship._start_node, relationship._end_node = start, end
+        return relationship
+
+    @staticmethod
+    def _name(props):
+        return props.get("name") or props.get("title")
+
+    def _find(self, key, label):
+        node_id = key if key in self.props else self.by_name.get(str(key).casefold())
+        if node_id is None or (label == "Person") != ("personId" in self.props[node_id]):
+            return None
+        return node_id
+
+    def _ranked(self, node_ids):
+        return sorted(node_ids, key=lambda i: -self.props[i]["pageRank"])
+
+    # -- the driver surface -------------------------------------------------
+
+    async def execute_query(self, query, parameters_=None, **kwargs):
+        await asyncio.sleep(0)
+        text = getattr(query, "text", query)
+        if text.startswith("EXPLAIN "):
+            plan = {"operatorType": "ProduceResults@neo4j",
+                    "arguments": {"EstimatedRows": float(GENERATED_LIMIT)}, "children": []}
+            return [], StubSummary(plan), []
+        rows = self.answer(text, parameters_ or {})
+        return [Record(r) for r in rows], StubSummary(), list(rows[0]) if rows else []
+
+    @asynccontextmanager
+    async def _session(self):
+        yield StubSession(self)
+
+    def session(self, **kwargs):
+        return self._session()
+
+    async def close(self):
+        pass
+
+    # -- answering ----------------------------------------------------------
+
+    def answer(self, text, params):
+        if text == READ_GENERATION_CYPHER:
+            return [{"generation": self.generation}]
+        if "db.index.fulltext.queryNodes" in text:
+            return self._fulltext(text, params)
+        if text == EXPAND_PERSON_CYPHER:
+            return self._expand_person(params)
+        if text == EXPAND_PERSON_CREW_CYPHER:
+            return self._crew(params)
+        if text == EXPAND_MOVIE_CYPHER:
+            return self._expand_movie(params)
+        if text == EXPAND_PERSONS_BATCH_CYPHER:
+            return self._batch(params, "person", self._expand_person, "movieLimit")
+        if text == EXPAND_MOVIES_BATCH_CYPHER:
+            return self._batch(params, "movie", self._expand_movie, "personLimit")
+        return self._generated(text, params)
+
+    def _fulltext(self, text, params):
+        person = "personNameIndex" in text
+        names = {i: self._name(p) for i, p in self.props.items()
+                 if ("personId" in p) == person}
+        rows = []
+        for i, query in enumerate(params.get("queries", [])):
+            exact = self._find(query["exact"].strip('"'), "Person" if person else "Movie")
+            if exact is not None:
+                rows.append({"i": i, "match": names[exact], "score": 10.0, "exact": True})
+            fuzzy = query["fuzzy"].replace("~", "")
+            best = process.extractOne(fuzzy, names, scorer=fuzz.WRatio)
+            if best is not None:
+                # Lucene scores are unbounded; WRatio / 20 lands a good match
+                # above the 3.0 the mapper asks for, as the real index does.
+                rows.append({"i": i, "match": best[0], "score": best[1] / 20, "exact": False})
+        return rows
+
+    def _films(self, person_id):
+        return self._ranked(m for p, m in self.roles if p == person_id)
+
+    def _cast(self, movie_id):
+        return self._ranked(p for p, m in self.roles if m == movie_id)
+
+    def _expand_person(self, params):
+        person_id = self._find(params["person"], "Person")
+        if person_id is None:
+            return []
+        movies = [{"movie": self.props[m], "roles": sorted(self.roles[(person_id, m)])}
+                  for m in self._films(person_id)[:params["movieLimit"]]]
+        return [{"person": self.props[person_id], "movies": movies}]
+
+    def _crew(self, params):
+        rows = []
+        for index, movie_id in enumerate(params["movieIds"]):
+            cast = self._cast(movie_id)
+            for p in cast:
+                if "DIRECTED" in self.roles[(p, movie_id)]:
+                    rows.append((-1, index, {"movieId": movie_id, "person": self.props[p],
+                                             "label": "DIRECTED", "rank": -1}))
+            actors = [p for p in cast if "ACTED_IN" in self.roles[(p, movie_id)]]
+            for rank, p in enumerate(actors[:params["actorLimit"]]):
+                rows.append((rank, index, {"movieId": movie_id, "person": self.props[p],
+                                           "label": "ACTED_IN", "rank": rank}))
+        rows.sort(key=lambda r: (r[0], r[1]))
+        return [row for _, _, row in rows]
+
+    def _expand_movie(self, params):
+        movie_id = self._find(params["movie"], "Movie")
+        if movie_id is None:
+            return []
+        people = [{"person": self.props[p], "roles": sorted(self.roles[(p, movie_id)])}
+                  for p in self._cast(movie_id)[:params["personLimit"]]]
+        return [{"movie": self.props[movie_id], "people": people}]
+
+    def _batch(self, params, kind, expand, limit):
+        # One row per seed that matched, as the UNWIND ... CALL {} query returns.
+        rows = []
+        for seed in params["seeds"]:
+            for row in expand({kind: seed["id"], limit: seed["limit"]}):
+                rows.append({"seed": seed["id"], **row})
+        return rows
+
+    def _generated(self, text, params):
+        mentioned = {str(v).casefold() for v in params.values() if isinstance(v, str)}
+        folded = text.casefold()
+        focus = {i for name, i in self.by_name.items()
+                 if name in mentioned or f'"{name}"' in folded or f"'{name}'" in folded}
+        projected = "elementId(" in text
+        matched = [key for key in self.relationships
+                   if not focus or key[0] in focus or key[2] in focus]
+        matched.sort(key=lambda key: -self.props[key[0]]["pageRank"])
+        rows = []
+        for key in matched[:GENERATED_LIMIT]:
+            p, m = self.nodes[key[0]], self.nodes[key[2]]
+            relationship, bare = self.relationships[key]
+            if projected:
+                rows.append({"p": self._projection(text, "p", p), "r": bare,
+                             "m": self._projection(text, "m", m)})
+            else:
+                rows.append({"p": p, "r": relationship, "m": m})
+        return rows
+
+    @staticmethod
+    def _projection(text, variable, node):
+        """`node` as the statement's `<variable> {.a, .b, elementId: ...}` gives it."""
+        match = re.search(rf"\b{variable}\s*\{{([^}}]*)\}}", text)
+        fields = re.findall(r"\.(\w+)", match.group(1)) if match else list(node.keys())
+        projection = {field: node.get(field) for field in fields}
+        projection["elementId"] = node.element_id
+        return projection
+
+    # -- node store ---------------------------------------------------------
+
+    def node_columns(self):
+        """Column lists per id prefix, as `NodeTable.build` takes them."""
+        from app.services.node_store import CENTRALITIES, TABLES
+
+        columns = {}
+        for prefix, (_, _, _, string_columns) in TABLES.items():
+            nodes = [p for i, p in self.props.items() if i.startswith(prefix)]
+            collected = {"key": [int(self._id(p)[2:]) for p in nodes],
+                         "year": [p.get("year") for p in nodes]}
+            for column in string_columns:
+                collected[column] = [self._name(p) if column == "label" else None
+                                     for p in nodes]
+            for centrality in CENTRALITIES:
+                collected[centrality] = [p.get(centrality) for p in nodes]
+            columns[prefix] = (collected, string_columns)
+        return columns
+
+    @staticmethod
+    def _id(props):
+        return props.get("personId") or props.get("movieId")
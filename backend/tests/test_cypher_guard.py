@@ -0,0 +1,49 @@
+import pytest
+
+from app.services.tools.cypher_guard import (GUARD_MAX_HOPS, _hops_violation,
+                                             _plan_violation, _quantifier_violation)
+
+
+@pytest.mark.parametrize("cypher", [
+    "MATCH p = shortestPath((a)-[*]-(b)) RETURN p",
+    "MATCH (a)-[r:ACTED_IN*1..]-(b) RETURN b",
+    f"MATCH (a)-[*..{GUARD_MAX_HOPS + 1}]-(b) RETURN b",
+])
+def test_variable_length_without_a_small_bound_is_rejected(cypher):
+    assert _hops_violation(cypher) is not None
+
+
+@pytest.mark.parametrize("cypher", [
+    "MATCH ((a)-[:R]->(b)){1,} RETURN b",
+    "MATCH ((a)-[:R]->(b))+ (c) RETURN c",
+    "MATCH (:Person) ((a)--(b))* (:Movie) RETURN a",
+    f"MATCH ((a)-[:R]->(b)){{{GUARD_MAX_HOPS + 1}}} RETURN b",
+    f"MATCH (a)-[:R]->{{1,{GUARD_MAX_HOPS + 5}}}(b) RETURN b",
+    "MATCH (a)-[:R]-+(b) RETURN b",
+    "MATCH (a)-[:R]->{}(b) RETURN b",
+])
+def test_unbounded_or_long_quantifiers_are_rejected(cypher):
+    assert _quantifier_violation(cypher) is not None
+
+
+@pytest.mark.parametrize("cypher", [
+    "MATCH ((a)-[:R]->(b)){1,3} RETURN b",
+    "MATCH ((a)-[:R]->(b)){,2} RETURN b",
+    "MATCH (a)-[:R]->{2}(b) RETURN b",
+    "RETURN (a.x + 1) * 2, (b) + 3",
+    'MATCH (a {name: "((x)--(y))+"}) RETURN a',
+    "MATCH (m:Movie) WHERE (m)<-[:ACTED_IN]-(:Person) RETURN m LIMIT 60",
+])
+def test_bounded_quantifiers_and_arithmetic_pass(cypher):
+    assert _quantifier_violation(cypher) is None
+    assert _hops_violation(cypher) is None
+
+
+def test_plan_violations():
+    scan = {"operatorType": "ProduceResults@neo4j", "arguments": {},
+            "children": [{"operatorType": "AllNodesScan@neo4j", "arguments": {}}]}
+    assert "every node" in _plan_violation(scan)
+    assert _plan_violation({"operatorType": "NodeByLabelScan",
+                            "arguments": {"EstimatedRows": 1e12}}) is not None
+    assert _plan_violation({"operatorType": "NodeByLabelScan",
+                            "arguments": {"EstimatedRows": 60.0}}) is None
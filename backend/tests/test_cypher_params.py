@@ -0,0 +1,78 @@
+from app.services.tools.cypher_params import PlanCacheEstimate, parameterize
+
+
+def test_string_and_number_literals_become_parameters():
+    cypher, params = parameterize(
+        'MATCH (m:Movie {title: "Titanic"}) WHERE m.year >= \'1995\' AND m.rating > 7.5 RETURN m')
+    assert cypher == ("MATCH (m:Movie {title: $lit0}) WHERE m.year >= $lit1"
+                      " AND m.rating > $lit2 RETURN m")
+    assert params == {"lit0": "Titanic", "lit1": "1995", "lit2": 7.5}
+
+
+def test_questions_differing_in_a_name_share_one_statement():
+    template = 'MATCH (p:Person)-[r]->(m:Movie {{title: "{}"}}) RETURN p, r, m'
+    titanic, _ = parameterize(template.format("Titanic"))
+    vertigo, _ = parameterize(template.format("Vertigo"))
+    assert titanic == vertigo
+
+
+def test_limit_skip_and_hop_bounds_are_kept():
+    cypher, params = parameterize("MATCH (a)-[*1..3]-(b) RETURN b SKIP 5 LIMIT 60")
+    assert cypher == "MATCH (a)-[*1..3]-(b) RETURN b SKIP 5 LIMIT 60"
+    assert params == {}
+
+
+def test_quantified_path_pattern_bounds_are_kept():
+    for quantifier in ("{1,3}", "{2}", "{1,}", "{,3}"):
+        cypher = f"MATCH ((x)-[:R]->(y)){quantifier} RETURN y LIMIT 60"
+        assert parameterize(cypher) == (cypher, {})
+
+
+def test_leading_dot_float_is_one_literal():
+    assert parameterize("MATCH (m) WHERE m.score > .5 RETURN m") == (
+        "MATCH (m) WHERE m.score > $lit0 RETURN m", {"lit0": 0.5})
+
+
+def test_hex_and_octal_are_one_literal():
+    assert parameterize("RETURN 0x1F, 0o17") == ("RETURN $lit0, $lit1",
+                                                 {"lit0": 31, "lit1": 15})
+
+
+def test_slice_bounds_are_not_floats():
+    assert parameterize("RETURN [1, 2, 3][1..2]") == (
+        "RETURN [$lit0, $lit1, $lit2][$lit3..$lit4]",
+        {"lit0": 1, "lit1": 2, "lit2": 3, "lit3": 1, "lit4": 2})
+
+
+def test_identifiers_comments_and_backquotes_are_left_alone():
+    cypher, params = parameterize(
+        "MATCH (m) // year 1958\nWHERE m.title_fr = $movie0 RETURN m.`title 2`")
+    assert cypher == "MATCH (m) // year 1958\nWHERE m.title_fr = $movie0 RETURN m.`title 2`"
+    assert params == {}
+
+
+def test_escapes_are_decoded():
+    _, params = parameterize(r"RETURN 'L\'Avventura', 'tab\there', 'é'")
+    assert params == {"lit0": "L'Avventura", "lit1": "tab\there", "lit2": "é"}
+
+
+def test_caller_parameters_are_kept_and_never_shadowed():
+    cypher, params = parameterize("MATCH (p {name: $lit0}) WHERE p.x = 'y' RETURN p",
+                                  {"lit0": "Alfred Hitchcock"})
+    assert cypher == "MATCH (p {name: $lit0}) WHERE p.x = $lit1 RETURN p"
+    assert params == {"lit0": "Alfred Hitchcock", "lit1": "y"}
+
+
+def test_unterminated_string_is_returned_unchanged():
+    cypher = 'MATCH (m {title: "Titanic) RETURN m'
+    assert parameterize(cypher, {"a": 1}) == (cypher, {"a": 1})
+
+
+def test_plan_cache_estimate_evicts_least_recently_run():
+    cache = PlanCacheEstimate(size=2)
+    assert not cache.observe("A")
+    assert not cache.observe("B")
+    assert cache.observe("A")
+    assert not cache.observe("C")  # evicts B, the least recent
+    assert cache.observe("A")
+    assert not cache.observe("B")
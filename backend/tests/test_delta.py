@@ -0,0 +1,90 @@
+import pytest
+
+from app.services.tools.delta import BloomFilter, _fnv1a, delta, known_set
+
+PAYLOAD = {
+    "nodes": [
+        {"id": "nm0000033", "label": "Alfred Hitchcock", "type": "Person", "isCenter": True},
+        {"id": "tt0052357", "label": "Vertigo", "type": "Movie", "subjectRoles": ["DIRECTED"]},
+        {"id": "nm0000071", "label": "James Stewart", "type": "Person"},
+    ],
+    "links": [
+        {"source": "nm0000033", "target": "tt0052357", "label": "DIRECTED"},
+        {"source": "nm0000071", "target": "tt0052357", "label": "ACTED_IN"},
+    ],
+    "center": "nm0000033",
+}
+
+
+def test_fnv1a_matches_the_reference_vectors():
+    # The layout is documented for clients to reimplement; pin the hash.
+    assert _fnv1a(b"") == 0x811C9DC5
+    assert _fnv1a(b"a") == 0xE40C292C
+    assert _fnv1a(b"foobar") == 0xBF9CF968
+
+
+def test_bloom_encodes_and_decodes_the_same_bits():
+    ids = [f"nm{i:07d}" for i in range(200)]
+    bloom = BloomFilter.of(ids, 256, 7)
+    decoded = BloomFilter.decode(bloom.encode(), 7)
+    assert bytes(decoded.bits) == bytes(bloom.bits)
+    assert all(node_id in decoded for node_id in ids)  # no false negatives
+
+
+def test_bloom_bit_layout_is_lsb_first():
+    bloom = BloomFilter.of(["tt0052357"], 8, 1)
+    (j,) = bloom._positions("tt0052357")
+    assert bloom.bits[j >> 3] == 1 << (j & 7)
+    assert sum(bin(b).count("1") for b in bloom.bits) == 1
+
+
+def test_bloom_false_positive_rate_is_near_the_design_rate():
+    # ~9.6 bits per id and k=7 is the textbook 1%.
+    ids = [f"nm{i:07d}" for i in range(1000)]
+    bloom = BloomFilter.of(ids, 1200, 7)
+    others = [f"tt{i:07d}" for i in range(10000)]
+    rate = sum(node_id in bloom for node_id in others) / len(others)
+    assert rate < 0.03
+
+
+def test_a_false_positive_comes_back_as_a_reference_not_a_node():
+    bloom = BloomFilter.of(["nm0000033"], 1, 1)  # 8 bits: collisions are easy
+    (bit,) = bloom._positions("nm0000033")
+    colliding = next(f"tt{i:07d}" for i in range(10000)
+                     if next(iter(bloom._positions(f"tt{i:07d}"))) == bit)
+    payload = {"nodes": [{"id": "nm0000033"}, {"id": colliding}], "links": []}
+    result = delta(payload, bloom)
+    # The client can tell: an id under `known` it does not hold.
+    assert result["nodes"] == []
+    assert {r["id"] for r in result["known"]} == {"nm0000033", colliding}
+
+
+@pytest.mark.parametrize("text, k", [("!!", 5), ("", 5), ("AAAA", 0), ("AAAA", 33)])
+def test_malformed_filters_are_rejected(text, k):
+    with pytest.raises(ValueError):
+        BloomFilter.decode(text, k)
+
+
+def test_known_set():
+    assert known_set() is None
+    assert known_set(",,") is None
+    assert known_set("nm1,,tt2") == {"nm1", "tt2"}
+    bloom = BloomFilter.of(["nm1"], 16, 3)
+    assert "nm1" in known_set("ignored", bloom.encode(), 3)
+    with pytest.raises(ValueError):
+        known_set(bloom=bloom.encode())  # no bloom_k
+
+
+def test_delta_keeps_new_nodes_all_links_and_references_known_ones():
+    result = delta(PAYLOAD, {"nm0000033", "tt0052357"})
+    assert result["nodes"] == [PAYLOAD["nodes"][2]]
+    assert result["links"] == PAYLOAD["links"]
+    assert result["known"] == [{"id": "nm0000033", "isCenter": True},
+                               {"id": "tt0052357", "subjectRoles": ["DIRECTED"]}]
+    assert result["center"] == "nm0000033"
+
+
+def test_delta_leaves_the_cached_payload_alone():
+    before = {**PAYLOAD, "nodes": list(PAYLOAD["nodes"])}
+    delta(PAYLOAD, {"nm0000033"})
+    assert PAYLOAD == before and "known" not in PAYLOAD
@@ -0,0 +1,80 @@
+from neo4j import Record
+from neo4j.graph import Graph, Node, Path
+
+from app.services.tools.neo4j_to_json import D3Builder, to_d3_format
+
+graph = Graph()
+hitchcock = Node(graph, "4:db:1", 1, ["Person"], {"personId": "nm0000033",
+                                                  "name": "Alfred Hitchcock"})
+stewart = Node(graph, "4:db:2", 2, ["Person"], {"personId": "nm0000071",
+                                                "name": "James Stewart"})
+vertigo = Node(graph, "4:db:3", 3, ["Movie"], {"movieId": "tt0052357", "title": "Vertigo",
+                                               "year": "1958", "embedding": [0.0] * 32})
+
+
+def relationship(start, type_, end, element_id):
+    rel = graph.relationship_type(type_)(graph, element_id, int(element_id.split(":")[-1]), {})
+    rel._start_node, rel._end_node = start, end
+    return rel
+
+
+directed = relationship(hitchcock, "DIRECTED", vertigo, "5:db:10")
+acted_in = relationship(stewart, "ACTED_IN", vertigo, "5:db:11")
+
+
+def test_raw_records_become_nodes_and_links():
+    d3 = to_d3_format([Record({"p": hitchcock, "r": directed, "m": vertigo})])
+    assert [n["id"] for n in d3["nodes"]] == ["nm0000033", "tt0052357"]
+    assert d3["nodes"][1] == {"id": "tt0052357", "label": "Vertigo", "type": "Movie",
+                              "year": "1958"}
+    assert d3["links"] == [{"source": "nm0000033", "target": "tt0052357",
+                            "label": "DIRECTED"}]
+
+
+def test_nodes_and_links_are_deduplicated_across_rows():
+    builder = D3Builder()
+    builder.add(Record({"p": hitchcock, "r": directed, "m": vertigo}))
+    new_nodes, new_links = builder.add(Record({"p": hitchcock, "r": directed, "m": vertigo}))
+    assert (new_nodes, new_links) == ([], [])
+    assert builder.records == 2
+    assert len(builder.result()["nodes"]) == 2 and len(builder.result()["links"]) == 1
+
+
+def test_relationship_listed_before_its_nodes_still_links():
+    d3 = to_d3_format([Record({"r": acted_in, "p": stewart, "m": vertigo})])
+    assert d3["links"] == [{"source": "nm0000071", "target": "tt0052357",
+                            "label": "ACTED_IN"}]
+
+
+def test_paths_and_collected_lists_are_unpacked():
+    d3 = to_d3_format([Record({"path": Path(hitchcock, directed),
+                               "cast": [stewart, acted_in]})])
+    assert {n["id"] for n in d3["nodes"]} == {"nm0000033", "tt0052357", "nm0000071"}
+    assert {(l["source"], l["label"]) for l in d3["links"]} == {("nm0000033", "DIRECTED"),
+                                                                ("nm0000071", "ACTED_IN")}
+
+
+def test_projected_nodes_resolve_relationship_ends_by_element_id():
+    projected = Node(graph, "4:db:1", 1, ["Person"], {})  # a relationship end, no properties
+    rel = relationship(projected, "DIRECTED", Node(graph, "4:db:3", 3, ["Movie"], {}), "5:db:12")
+    d3 = to_d3_format([Record({
+        "r": rel,
+        "p": {"personId": "nm0000033", "name": "Alfred Hitchcock", "elementId": "4:db:1"},
+        "m": {"movieId": "tt0052357", "title": "Vertigo", "elementId": "4:db:3"},
+    })])
+    assert d3["links"] == [{"source": "nm0000033", "target": "tt0052357",
+                            "label": "DIRECTED"}]
+
+
+def test_links_to_unknown_ends_are_dropped():
+    stranger = Node(graph, "4:db:99", 99, ["Person"], {})
+    rel = relationship(stranger, "ACTED_IN", vertigo, "5:db:13")
+    d3 = to_d3_format([Record({"r": rel, "m": vertigo})])
+    assert d3["links"] == []
+
+
+def test_data_dict_rows_are_still_accepted():
+    row = {"p": dict(hitchcock), "r": (dict(hitchcock), "DIRECTED", dict(vertigo)),
+           "m": dict(vertigo)}
+    assert to_d3_format([row]) == to_d3_format([Record({"p": hitchcock, "r": directed,
+                                                        "m": vertigo})])
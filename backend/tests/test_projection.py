@@ -0,0 +1,77 @@
+from app.services.tools.projection import (ANY_FIELDS, MOVIE_FIELDS, PERSON_FIELDS,
+                                           map_projection, project_return)
+
+PERSON = map_projection(PERSON_FIELDS)
+MOVIE = map_projection(MOVIE_FIELDS)
+
+
+def test_map_projection():
+    assert map_projection(("a", "b")) == "{.a, .b}"
+    assert map_projection(("a",), "n") == "{.a, elementId: elementId(n)}"
+
+
+def test_nodes_projected_by_label_and_carry_element_id_beside_relationships():
+    cypher = "MATCH (p:Person)-[r:ACTED_IN]->(m:Movie) RETURN p, r, m LIMIT 60"
+    assert project_return(cypher) == (
+        f"MATCH (p:Person)-[r:ACTED_IN]->(m:Movie) RETURN p {map_projection(PERSON_FIELDS, 'p')}"
+        f" AS p, r, m {map_projection(MOVIE_FIELDS, 'm')} AS m LIMIT 60")
+
+
+def test_nodes_alone_need_no_element_id():
+    assert project_return("MATCH (p:Person) RETURN DISTINCT p AS person LIMIT 3") == (
+        f"MATCH (p:Person) RETURN DISTINCT p {PERSON} AS person LIMIT 3")
+
+
+def test_unlabelled_node_gets_both_labels_fields():
+    assert project_return("MATCH (n) RETURN n LIMIT 5") == (
+        f"MATCH (n) RETURN n {map_projection(ANY_FIELDS)} AS n LIMIT 5")
+
+
+def test_order_by_property_after_return_is_kept():
+    projected = project_return("MATCH (m:Movie) RETURN m ORDER BY m.pageRank DESC LIMIT 5")
+    assert projected == (f"MATCH (m:Movie) RETURN m {map_projection(MOVIE_FIELDS + ('pageRank',))}"
+                         " AS m ORDER BY m.pageRank DESC LIMIT 5")
+
+
+def test_path_becomes_projected_nodes_and_its_relationships():
+    projected = project_return("MATCH path = (a:Person)-[*1..2]-(b:Person) RETURN path LIMIT 5")
+    assert projected == (
+        "MATCH path = (a:Person)-[*1..2]-(b:Person) RETURN"
+        f" [n IN nodes(path) | n {map_projection(ANY_FIELDS, 'n')}] + relationships(path)"
+        " AS path LIMIT 5")
+
+
+def test_path_rewrite_does_not_shadow_the_statements_own_variables():
+    cypher = ("MATCH p = shortestPath((n:Person {name: $a})-[*..4]-(n1:Person))"
+              " RETURN p, n, n1")
+    projected = project_return(cypher)
+    assert projected == (
+        "MATCH p = shortestPath((n:Person {name: $a})-[*..4]-(n1:Person)) RETURN"
+        f" [n2 IN nodes(p) | n2 {map_projection(ANY_FIELDS, 'n2')}] + relationships(p) AS p,"
+        f" n {map_projection(PERSON_FIELDS, 'n')} AS n,"
+        f" n1 {map_projection(PERSON_FIELDS, 'n1')} AS n1")
+
+
+def test_only_the_final_return_is_rewritten():
+    cypher = ("MATCH (p:Person)-[r]->(m:Movie) WITH p, r, m ORDER BY p.pageRank DESC"
+              " LIMIT 60 RETURN p, r, m")
+    projected = project_return(cypher)
+    assert projected.startswith("MATCH (p:Person)-[r]->(m:Movie) WITH p, r, m ORDER BY")
+    assert projected.endswith(f"RETURN p {map_projection(PERSON_FIELDS, 'p')} AS p, r,"
+                              f" m {map_projection(MOVIE_FIELDS, 'm')} AS m")
+
+
+def test_return_inside_a_string_is_not_the_return():
+    projected = project_return('MATCH (p:Person {name: "RETURN p"}) RETURN p')
+    assert projected == f'MATCH (p:Person {{name: "RETURN p"}}) RETURN p {PERSON} AS p'
+
+
+def test_left_alone():
+    for cypher in (
+        "MATCH (a:Person) RETURN a UNION MATCH (a:Person) RETURN a",
+        "MATCH (a:Person) RETURN *",
+        "MATCH (p:Person) RETURN p.name AS name, count(*) AS c",
+        'MATCH (m:Movie {title: "unterminated) RETURN m',
+        "MATCH (p:Person) WITH p AS q RETURN q",
+    ):
+        assert project_return(cypher) == cypher
@@ -91,6 +91,13 @@ CREATE FULLTEXT INDEX movieTitleIndex IF NOT EXISTS FOR (n:Movie)
   ON EACH [n.title, n.originalTitle, n.title_fr, n.title_es, n.title_pt, n.title_it];
 CYPHER
 
+# A new store is a new data generation (see backend/app/services/generation.py).
+# The API is stopped, so its in-memory caches are gone anyway; this is for
+# anything keyed on the generation that outlives the process. Same statement as
+# BUMP_GENERATION_CYPHER there.
+docker compose exec -T neo4j cypher-shell -u neo4j -p "$NEO4J_PASSWORD" \
+  "MERGE (g:DataGeneration {name: 'imdb'}) SET g.value = timestamp()" >/dev/null
+
 echo
 echo "==> import done. Still required before the app is usable:"
 echo "      docker compose exec fastapi python -m app.services.compute_centrality"